@@ -0,0 +1,350 @@
+"""ASGI entry point for the resources, modules and planets API
+
+`uvicorn asgi:app` serves the full listings and the /changes feed with async
+handlers, so idle or long-polling clients cost a coroutine instead of a
+worker thread. Every other request, and any argument the async handlers
+don't take, goes to server.py's Flask app run on a worker thread, so routes,
+validation and error bodies are Flask's own; request and response bodies
+stream through it chunk by chunk. Stores that block on I/O
+(sqlite) are read from a worker thread, the in-memory store straight from
+the event loop since its reads never wait on a lock.
+
+List endpoints take `wait` on top of server.py's arguments: with an
+If-None-Match matching the current listing, the response is held up to that
+many seconds until the collection changes, then answered with the new
+listing, or with 304 if nothing changed. The /changes feed's long polls wait
+the same way.
+"""
+import asyncio
+import io
+import sys
+import threading
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+import server
+
+PREFIX = '/astro/v1'
+# a waiting long poll rechecks a blocking store this often, for writes made by other processes
+POLL_INTERVAL = server.CHANGES_POLL_INTERVAL
+
+# list path: (kind, list model)
+LISTINGS = {f"{PREFIX}/{segment}/": (kind, server.LISTINGS[kind])
+            for segment, kind in (('Resources', 'resources'), ('Modules', 'modules'),
+                                  ('Planets', 'planets'))}
+CHANGES_PATH = f"{PREFIX}/changes/"
+
+wait_parser = server.list_parser.copy()
+wait_parser.add_argument("wait", type=server.wait_seconds,
+                         help="Seconds to hold a conditional request open for a change",
+                         location="args")
+
+
+class ChangeWaiters:
+    """Wakes coroutines waiting for any of some collections to be written to
+
+    Writes can land on any thread, so waiters are woken through their own
+    event loop. generation counts the writes seen; read it before looking at
+    the collection and pass it to wait so a write landing in between isn't
+    missed.
+    """
+
+    def __init__(self, *collections):
+        self.generation = 0
+        self._waiters = set()
+        self._lock = threading.Lock()
+        for collection in collections:
+            collection.subscribe(self._changed)
+
+    def _changed(self, old, new):
+        with self._lock:
+            self.generation += 1
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    async def wait(self, seen, timeout):
+        """Return once there has been a write since generation seen, or after timeout seconds"""
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            if self.generation != seen:
+                return
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+WAITERS = {kind: ChangeWaiters(collection) for kind, collection in server.DATABASE.items()}
+# subscribed after server.CHANGES, so the change log already has a write when its waiters wake
+FEED = ChangeWaiters(*server.DATABASE.values())
+
+
+async def off_loop(collection, func, *args):
+    """func(*args), in a worker thread when the collection's store blocks"""
+    if collection.blocking:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+def in_app(func, *args):
+    """func(*args) inside the Flask app context server.py's helpers expect"""
+    with server.app.app_context():
+        return func(*args)
+
+
+def flask_request(scope):
+    """A Flask request context for the path and query string of scope"""
+    return server.app.test_request_context(scope['path'], query_string=scope['query_string'])
+
+
+def parse_args(scope, parser):
+    """The query arguments of scope as parser reads them, raising HTTPException like Flask"""
+    with flask_request(scope):
+        return parser.parse_args()
+
+
+def flask_error(scope, error):
+    """(status, body, headers) of the response server.py gives for an HTTPException"""
+    with flask_request(scope):
+        response = server.api.handle_error(error)
+    return (response.status_code, response.get_data(),
+            [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers])
+
+
+def json_response(status, body, extra=()):
+    """(status, body, headers) of a JSON body plus extra headers"""
+    headers = [(b'content-length', str(len(body)).encode()),
+               (b'content-type', b'application/json')]
+    return status, body, headers + list(extra)
+
+
+def cache_headers(etag, encoding):
+    """Response headers of a negotiated CachedBody, as the ASGI header list"""
+    headers = [(b'etag', quote_etag(etag).encode()), (b'vary', b'Accept-Encoding')]
+    if encoding is not None:
+        headers.append((b'content-encoding', encoding.encode()))
+    return headers
+
+
+async def cached_listing(kind, model, collection):
+    """The CachedBody of a full listing, serialized on a worker thread when it isn't cached
+
+    Marshalling a large listing takes long enough to hold up every other
+    request on the event loop, whichever store it comes from.
+    """
+    snapshot = await off_loop(collection, collection.snapshot)
+    if not collection.blocking:
+        entry = server.RESPONSES.get(kind, snapshot.version)
+        if entry is not None:
+            return entry
+    return await asyncio.to_thread(in_app, server.cached_listing, kind, model, snapshot)
+
+
+async def list_endpoint(kind, model, wait, headers):
+    """(status, body, headers) for a full listing, waiting for a change when asked to
+
+    The listing comes in the encoding Accept-Encoding prefers, serialized
+    and compressed on a worker thread the first time since that can take a
+    tenth of a second.
+    """
+    collection = server.DATABASE[kind]
+    accept = parse_accept_header(headers.get(b'accept-encoding', b'').decode('latin-1'))
+    deadline = asyncio.get_running_loop().time() + (wait or 0)
+    known = parse_etags(headers.get(b'if-none-match', b'').decode('latin-1') or None)
+    while True:
+        seen = WAITERS[kind].generation
+        entry = await cached_listing(kind, model, collection)
+        body, etag, encoding = await asyncio.to_thread(server.negotiate, entry, accept)
+        if not known.contains(etag):
+            return json_response(200, body, cache_headers(etag, encoding))
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            return json_response(304, b'', cache_headers(etag, encoding))
+        await WAITERS[kind].wait(seen, min(remaining, POLL_INTERVAL) if collection.blocking
+                                 else remaining)
+
+
+async def changes_endpoint(args):
+    """(status, body, headers) for the change feed, waiting for a change"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args['wait']
+    blocking = any(collection.blocking for collection in server.DATABASE.values())
+    while True:
+        seen = FEED.generation
+        for collection in server.DATABASE.values():
+            await off_loop(collection, collection.sync)
+        if blocking:
+            page = await asyncio.to_thread(server.change_page_data, args['since'],
+                                           args['limit'], args['epoch'])
+        else:
+            page = server.change_page_data(args['since'], args['limit'], args['epoch'])
+        remaining = deadline - loop.time()
+        if page['changes'] or args['since'] is None or remaining <= 0:
+            return json_response(200, in_app(server.json_bytes, page, server.change_page))
+        await FEED.wait(seen, min(remaining, POLL_INTERVAL) if blocking else remaining)
+
+
+async def dispatch(scope):
+    """(status, body, headers) for the requests answered here, None for those left to Flask"""
+    if scope['method'] != 'GET':
+        return None
+    path = scope['path']
+    if path in LISTINGS:
+        args = parse_args(scope, wait_parser)
+        if args['limit'] is not None or args['after'] is not None or args['fields'] is not None:
+            return None
+        kind, model = LISTINGS[path]
+        return await list_endpoint(kind, model, args['wait'], dict(scope['headers']))
+    if path == CHANGES_PATH:
+        args = parse_args(scope, server.changes_parser)
+        # without a wait there is nothing to hold open
+        if not args['wait']:
+            return None
+        return await changes_endpoint(args)
+    return None
+
+
+class RequestBody(io.RawIOBase):
+    """The body of an ASGI request as the file a WSGI app reads, for a worker thread
+
+    Each read waits for the event loop to hand over the next chunk, so a
+    streamed upload is never held in memory whole.
+    """
+
+    def __init__(self, receive, loop):
+        super().__init__()
+        self._receive = receive
+        self._loop = loop
+        self._chunk = b''
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._more = False
+                break
+            self._chunk = message.get('body', b'')
+            self._more = message.get('more_body', False)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ of an ASGI http request, reading its body from the file body"""
+    host, port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # the body ends where the client's does, with or without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(scope, receive, send, loop):
+    """Answer the request with server.py's Flask app; call on a worker thread
+
+    The status and headers go out with the first chunk of the body, and
+    every chunk the app yields is sent as it comes, so streamed responses
+    stay streamed.
+    """
+    started = {}
+    pending = []
+
+    def emit(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def flush():
+        while pending:
+            emit(pending.pop(0))
+
+    def start_response(status, headers, exc_info=None):  # pylint: disable=unused-argument
+        started['status'] = int(status.split(' ', 1)[0])
+        pending.append({'type': 'http.response.start', 'status': started['status'],
+                        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                    for k, v in headers]})
+        return write
+
+    def write(data):
+        flush()
+        emit({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    chunks = server.app(wsgi_environ(scope, io.BufferedReader(RequestBody(receive, loop))),
+                        start_response)
+    try:
+        for chunk in chunks:
+            if chunk:
+                write(chunk)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    flush()
+    emit({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def lifespan(receive, send):
+    """Load the catalog at startup, the way create_app does"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.to_thread(server.create_app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    try:
+        response = await dispatch(scope)
+    except HTTPException as error:
+        response = flask_error(scope, error)
+    if response is None:
+        await asyncio.to_thread(run_wsgi, scope, receive, send, asyncio.get_running_loop())
+        return
+    status, body, headers = response
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,166 @@
+"""Compare WSGI and ASGI serving under many idle connections
+
+Starts the app once under werkzeug's threaded server (what `python server.py`
+runs) and once under uvicorn (`asgi:app`), each in one process. For each it
+opens --idle connections that send the start of a resources list request
+and then go quiet, the way slow and long-poll clients hold a connection, and
+measures request rate and latency of --clients busy clients fetching single
+records alongside them, a new connection per request.
+
+    python benchmarks/concurrency.py --idle 2000 --clients 50 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = {
+    'wsgi': [sys.executable, '-c',
+             "import sys, server; from werkzeug.serving import run_simple; "
+             "run_simple('127.0.0.1', int(sys.argv[1]), server.create_app(), threaded=True)"],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+             '--log-level', 'warning', '--backlog', '4096', '--port'],
+}
+LIST_PATH = '/astro/v1/Resources/'
+ITEM_PATH = '/astro/v1/Resources/Tungsten'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start(mode, port):
+    """The server process, once it accepts connections"""
+    process = subprocess.Popen(SERVERS[mode] + [str(port)], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server didn't start")
+
+
+def process_stats(pid):
+    """(threads, resident MB) of a process, from /proc"""
+    threads = rss = None
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('Threads:'):
+                threads = int(line.split()[1])
+            elif line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) / 1024
+    return threads, rss
+
+
+async def request(port, path):
+    """GET path on a new connection, returning the status"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n"
+                 .encode())
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    writer.close()
+    return int(lines[0].split()[1])
+
+
+async def idle_client(port, opened, release):
+    """Hold a connection with a request that never finishes until release is set"""
+    try:
+        _, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET {LIST_PATH} HTTP/1.1\r\nHost: 127.0.0.1\r\n".encode())
+        await writer.drain()
+    except OSError:
+        return
+    opened.append(writer)
+    await release.wait()
+    writer.close()
+
+
+async def busy_client(port, stop_at, latencies, errors):
+    while time.monotonic() < stop_at:
+        start_time = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(request(port, ITEM_PATH), 10)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            errors.append(1)
+            continue
+        if status != 200:
+            errors.append(1)
+        latencies.append(time.perf_counter() - start_time)
+
+
+async def measure(port, pid, idle, clients, seconds):
+    opened, release = [], asyncio.Event()
+    idlers = [asyncio.ensure_future(idle_client(port, opened, release)) for _ in range(idle)]
+    # give every idle connection time to be accepted
+    deadline = time.monotonic() + 30
+    while len(opened) < idle and time.monotonic() < deadline and not all(
+            task.done() for task in idlers):
+        await asyncio.sleep(0.2)
+    latencies, errors = [], []
+    stop_at = time.monotonic() + seconds
+    await asyncio.gather(*(busy_client(port, stop_at, latencies, errors)
+                           for _ in range(clients)))
+    stats = process_stats(pid)
+    release.set()
+    for task in idlers:
+        task.cancel()
+    return len(opened), latencies, errors, stats
+
+
+def report(mode, held, latencies, errors, seconds, stats):
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    threads, rss = stats
+    print(f"{mode}: {held} idle connections held, {len(latencies) / seconds:.0f} req/s, "
+          f"p50 {percentile(0.5):.1f} ms, p99 {percentile(0.99):.1f} ms, "
+          f"{len(errors)} errors, {threads} threads, {rss:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--idle', type=int, default=1000, help="idle keep-alive connections")
+    parser.add_argument('--clients', type=int, default=20, help="busy clients")
+    parser.add_argument('--seconds', type=float, default=5, help="how long busy clients run")
+    parser.add_argument('--mode', choices=sorted(SERVERS), action='append',
+                        help="only run this mode (repeatable)")
+    args = parser.parse_args()
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    for mode in args.mode or ('wsgi', 'asgi'):
+        port = free_port()
+        process = start(mode, port)
+        try:
+            held, latencies, errors, stats = asyncio.run(
+                measure(port, process.pid, args.idle, args.clients, args.seconds))
+            report(mode, held, latencies, errors, args.seconds, stats)
+        finally:
+            process.kill()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Fixtures for the server benchmarks
+
+Run from the repository root:
+
+    python -m pytest benchmarks --catalog-sizes 1000,100000,1000000
+
+Results are autosaved as JSON under .benchmarks/, one file per run named
+after the commit, so `--benchmark-compare` shows regressions between commits.
+"""
+import random
+
+import pytest
+from faker import Faker
+
+import server
+
+PLANETS = ['Sylva', 'Desolo', 'Calidor', 'Vesania', 'Novus', 'Glacio', 'Atrox']
+MACHINES = ['Smelting Furnace', 'Chemistry Lab', 'Soil Centrifuge', 'Trade Platform', 'Drill']
+PRINTERS = ['Backpack Printer', 'Small Printer', 'Medium Printer', 'Large Printer']
+
+
+def pytest_addoption(parser):
+    parser.addoption("--catalog-sizes", default="1000",
+                     help="Comma separated synthetic catalog sizes to benchmark against")
+
+
+def pytest_configure(config):
+    if not config.getoption("benchmark_disable", False):
+        config.option.benchmark_autosave = True
+
+
+def pytest_generate_tests(metafunc):
+    if "catalog" in metafunc.fixturenames:
+        sizes = [int(x) for x in metafunc.config.getoption("catalog_sizes").split(',')]
+        metafunc.parametrize("catalog", sizes, indirect=True, scope="module",
+                             ids=[f"{size}" for size in sizes])
+
+
+def synthetic_catalog(size, seed=20191029):
+    """size resources and size modules with Faker names and a crafting DAG
+
+    The first quarter of the resources are raw and found on planets, a few of
+    those are condenser gases; the rest are refined from earlier resources.
+    """
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    words = [word.capitalize() for word in fake.words(nb=500, unique=True)]
+    resources = []
+    for i in range(size):
+        name = f"{rng.choice(words)}_{i}"
+        if i < max(size // 4, 1):
+            found = rng.sample(PLANETS, rng.randint(1, 3))
+            rate = [f"{planet}:{rng.choice((25, 50, 75, 100))}" for planet in found] \
+                if rng.random() < 0.05 else []
+            resources.append(server.make_resource(name, found, ['Drill'], [], rate))
+        else:
+            refined_with = [resources[rng.randrange(i)]['name'] for _ in range(rng.randint(1, 3))]
+            resources.append(server.make_resource(name, [], [rng.choice(MACHINES)],
+                                                  refined_with, []))
+    modules = []
+    for i in range(size):
+        cost = [resources[rng.randrange(size)]['name'] for _ in range(rng.randint(1, 4))]
+        modules.append(server.make_module(f"{rng.choice(words)} {fake.word()} {i}", cost,
+                                          rng.choice(PRINTERS)))
+    return {'resources': resources, 'modules': modules}
+
+
+@pytest.fixture(scope="module")
+def catalog(request):
+    """Load a synthetic catalog of request.param resources and modules into the server"""
+    data = synthetic_catalog(request.param)
+    for collection in server.DATABASE.values():
+        collection.clear()
+    for kind, records in data.items():
+        server.DATABASE[kind].add_many(records)
+    yield data
+    for collection in server.DATABASE.values():
+        collection.clear()
+
+
+@pytest.fixture
+def app():
+    """The app under test, for pytest-flask's client fixture"""
+    return server.app
@@ -0,0 +1,97 @@
+"""The ASGI entry point answers the same as the Flask app, byte for byte"""
+import asyncio
+import threading
+
+import pytest
+
+import asgi
+
+BASE = '/astro/v1'
+
+
+def asgi_request(method, path, query=b'', body=b'', headers=(), chunks=None, sent=None):
+    """(status, body) of asgi.app answering one http request
+
+    chunks sends the body in several messages, and sent collects the
+    messages the app sends.
+    """
+    sent = [] if sent is None else sent
+    chunks = [body] if chunks is None else chunks
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': list(headers), 'http_version': '1.1', 'scheme': 'http',
+             'server': ('localhost', 80), 'root_path': ''}
+    asyncio.run(asgi.app(scope, receive, send))
+    assert not sent[-1].get('more_body')
+    return sent[0]['status'], b''.join(message['body'] for message in sent[1:])
+
+
+@pytest.mark.parametrize('path, query', [
+    ('/Resources/', b''),
+    ('/Resources/', b'limit=abc'),
+    ('/Resources/', b'limit=3&after=2&fields=name'),
+    ('/Resources/no such resource', b''),
+    ('/Resources/{resource}/tree', b''),
+    ('/Resources/{resource}/used-by', b''),
+    ('/Modules/{module}', b''),
+    ('/Planets/Sylva/available', b''),
+    ('/Default/', b''),
+    ('/changes/', b'since=abc&wait=1'),
+    ('/nowhere', b''),
+])
+def test_get_matches_flask(client, catalog, path, query):
+    path = BASE + path.format(resource=catalog['resources'][0]['name'],
+                              module=catalog['modules'][0]['name'])
+    expected = client.get(path, query_string=query.decode())
+    assert asgi_request('GET', path, query) == (expected.status_code, expected.get_data())
+
+
+def test_writes_go_to_flask(client, catalog):
+    status, _ = asgi_request('POST', f"{BASE}/Resources/bulk", body=b'[{"name": "Bulky"}]',
+                             headers=[(b'content-type', b'application/json')])
+    assert status == 201
+    assert client.get(f"{BASE}/Resources/Bulky").status_code == 200
+    assert asgi_request('DELETE', f"{BASE}/Resources/Bulky")[0] == 204
+    assert asgi_request('POST', f"{BASE}/Planets/")[0] == 405
+
+
+def test_bad_wait_is_a_flask_style_400(catalog):
+    status, body = asgi_request('GET', f"{BASE}/Resources/", b'wait=abc')
+    assert status == 400
+    assert b'"message": "Input payload validation failed"' in body
+
+
+def test_cold_listing_is_built_off_the_event_loop(catalog, monkeypatch):
+    threads = []
+    build = asgi.server.cached_listing
+
+    def cached_listing(*args):
+        threads.append(threading.current_thread())
+        return build(*args)
+    monkeypatch.setattr(asgi.server, 'cached_listing', cached_listing)
+    asgi.server.RESPONSES.evict('modules')
+    assert asgi_request('GET', f"{BASE}/Modules/")[0] == 200
+    assert threads and threading.main_thread() not in threads
+
+
+def test_streams_both_ways(client, catalog):
+    lines = [f'{{"name": "Streamed {i}"}}\n'.encode() for i in range(50)]
+    status, _ = asgi_request('POST', f"{BASE}/Resources/bulk", chunks=lines,
+                             headers=[(b'content-type', b'application/x-ndjson')])
+    assert status == 201
+    assert client.get(f"{BASE}/Resources/Streamed 49").status_code == 200
+    sent = []
+    status, body = asgi_request('GET', f"{BASE}/Default/export", sent=sent)
+    assert status == 200
+    assert body == client.get(f"{BASE}/Default/export").get_data()
+    assert len(sent) > 3
+    for i in range(50):
+        client.delete(f"{BASE}/Resources/Streamed {i}")
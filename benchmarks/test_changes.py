@@ -0,0 +1,69 @@
+"""Correctness tests of the change logs behind the /changes feed"""
+import pytest
+
+import store
+from changes import ChangeLog, ResyncRequired, SharedChangeLog
+
+BASE = '/astro/v1'
+KINDS = ('resources', 'modules')
+
+
+def worker(path):
+    """The collections one worker process opens on a shared store"""
+    return {kind: store.open_collection(f"sqlite:///{path}", kind) for kind in KINDS}
+
+
+def test_workers_share_one_feed(tmp_path):
+    path = tmp_path / 'catalog.db'
+    mine, theirs = worker(path), worker(path)
+    log = SharedChangeLog(mine)
+    start = log.seq
+    theirs['resources'].add({'name': 'a'})
+    theirs['modules'].add({'name': 'm'})
+    theirs['resources'].replace('a', {'name': 'b'})
+    mine['modules'].delete('m')
+    changes, cursor = log.since(start)
+    assert [(c.kind, c.name, c.record is not None) for c in changes] == [
+        ('resources', 'a', True), ('modules', 'm', True), ('resources', 'a', False),
+        ('resources', 'b', True), ('modules', 'm', False)]
+    assert [c.seq for c in changes] == list(range(start + 1, cursor + 1))
+    assert SharedChangeLog(theirs).epoch == log.epoch
+    # a page ending between a rename's delete and its put picks up at the put
+    first, middle = log.since(start, limit=3)
+    assert [c.name for c in first] == ['a', 'm', 'a']
+    rest, end = log.since(middle)
+    assert [c.name for c in rest] == ['b', 'm'] and end == cursor
+
+
+def test_trimmed_cursor_needs_resync(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, 'CHANGE_LOG_LIMIT', 3)
+    collections = worker(tmp_path / 'catalog.db')
+    log = SharedChangeLog(collections)
+    for i in range(6):
+        collections['resources'].add({'name': str(i)})
+    with pytest.raises(ResyncRequired):
+        log.since(0)
+    changes, _ = log.since(3)
+    assert [c.name for c in changes] == ['3', '4', '5']
+    with pytest.raises(ResyncRequired):
+        log.since(3, epoch='another')
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_cursor_ahead_is_an_error(tmp_path, shared):
+    collections = worker(tmp_path / 'catalog.db') if shared else {
+        kind: store.Collection() for kind in KINDS}
+    log = SharedChangeLog(collections) if shared else ChangeLog(100)
+    if not shared:
+        for kind, collection in collections.items():
+            log.watch(kind, collection)
+    collections['resources'].add({'name': 'a'})
+    with pytest.raises(ValueError):
+        log.since(log.seq + 1)
+
+
+def test_cursor_ahead_is_400(client, catalog):
+    cursor = client.get(f"{BASE}/changes/").json['next']
+    response = client.get(f"{BASE}/changes/", query_string={'since': cursor + 5})
+    assert response.status_code == 400
+    assert client.get(f"{BASE}/changes/", query_string={'since': cursor}).status_code == 200
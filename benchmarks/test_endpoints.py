@@ -0,0 +1,117 @@
+"""Benchmarks of the resource and module endpoints against synthetic catalogs"""
+from urllib.parse import quote
+
+import server
+
+BASE = '/astro/v1'
+
+
+def middle(records):
+    """A record from the middle of the catalog, so no scan gets lucky"""
+    return records[len(records) // 2]
+
+
+def test_list_resources_cached(benchmark, client, catalog):
+    client.get(f"{BASE}/Resources/")
+    response = benchmark(client.get, f"{BASE}/Resources/")
+    assert response.status_code == 200
+
+
+def test_list_resources_cold(benchmark, client, catalog):
+    def evict():
+        server.RESPONSES.evict('resources')
+    response = benchmark.pedantic(client.get, args=(f"{BASE}/Resources/",), setup=evict,
+                                  rounds=5)
+    assert response.status_code == 200
+
+
+def test_list_modules_cold(benchmark, client, catalog):
+    def evict():
+        server.RESPONSES.evict('modules')
+    response = benchmark.pedantic(client.get, args=(f"{BASE}/Modules/",), setup=evict,
+                                  rounds=5)
+    assert response.status_code == 200
+
+
+def test_list_resources_page(benchmark, client, catalog):
+    response = benchmark(client.get, f"{BASE}/Resources/?limit=50&fields=name")
+    assert response.status_code == 200
+
+
+def test_get_resource(benchmark, client, catalog):
+    name = middle(catalog['resources'])['name']
+    response = benchmark(client.get, f"{BASE}/Resources/{quote(name)}")
+    assert response.json['name'] == name
+
+
+def test_get_module(benchmark, client, catalog):
+    name = middle(catalog['modules'])['name']
+    response = benchmark(client.get, f"{BASE}/Modules/{quote(name)}")
+    assert response.json['name'] == name
+
+
+def test_put_resource(benchmark, client, catalog):
+    resource = middle(catalog['resources'])
+    form = {'name': resource['name'], 'found': 'Sylva, Desolo',
+            'refined_with': ', '.join(resource['refined_with'])}
+    response = benchmark(client.put, f"{BASE}/Resources/{quote(resource['name'])}", data=form)
+    assert response.status_code == 200
+
+
+def test_put_module(benchmark, client, catalog):
+    module = middle(catalog['modules'])
+    form = {'name': module['name'], 'resource_cost': ', '.join(module['resource_cost']),
+            'printer': module['printer']}
+    response = benchmark(client.put, f"{BASE}/Modules/{quote(module['name'])}", data=form)
+    assert response.status_code == 200
+
+
+def test_delete_resource(benchmark, client, catalog):
+    resource = middle(catalog['resources'])
+
+    def restore():
+        if not server.DATABASE['resources'].exists(resource['name']):
+            server.DATABASE['resources'].add(resource)
+    response = benchmark.pedantic(client.delete, args=(f"{BASE}/Resources/{quote(resource['name'])}",),
+                                  setup=restore, rounds=50)
+    restore()
+    assert response.status_code == 204
+
+
+def test_post_resource(benchmark, client, catalog):
+    def forget():
+        if server.DATABASE['resources'].exists('Benchmarkium'):
+            server.DATABASE['resources'].delete('Benchmarkium')
+    response = benchmark.pedantic(client.post, args=(f"{BASE}/Resources/",),
+                                  kwargs={'data': {'name': 'Benchmarkium', 'found': 'All'}},
+                                  setup=forget, rounds=50)
+    forget()
+    assert response.status_code == 201
+
+
+def test_post_resource_duplicate(benchmark, client, catalog):
+    name = middle(catalog['resources'])['name']
+    response = benchmark(client.post, f"{BASE}/Resources/", data={'name': name, 'found': 'All'})
+    assert response.status_code == 400
+
+
+def test_post_module_duplicate(benchmark, client, catalog):
+    module = middle(catalog['modules'])
+    form = {'name': module['name'], 'resource_cost': 'Compound', 'printer': 'Small Printer'}
+    response = benchmark(client.post, f"{BASE}/Modules/", data=form)
+    assert response.status_code == 400
+
+
+def test_hydrate(benchmark, catalog):
+    rows = [(r['name'], ', '.join(r['found']), ', '.join(r['crafted_in']),
+             ', '.join(r['refined_with']), ', '.join(r['rate'])) for r in catalog['resources']]
+
+    def empty():
+        server.DATABASE['resources'].clear()
+
+    def hydrate():
+        hydrator = server.ResourceListApi()
+        for row in rows:
+            hydrator.hydrate(*row)
+    benchmark.pedantic(hydrate, setup=empty, rounds=3)
+    assert len(server.DATABASE['resources']) == len(rows)
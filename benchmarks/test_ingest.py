@@ -0,0 +1,85 @@
+"""Benchmarks of the ingest pipeline over a data directory written from a synthetic catalog"""
+import csv
+import html
+import itertools
+
+import pytest
+
+import catalog as data_files
+import ingest
+import server
+
+
+def write_printing_table(path, modules):
+    """modules as a wiki printing table, repeated costs written as "x2"
+
+    Cost items are split by <br>, or on every other row by wrapping each
+    item after the first in <p>, the two ways the wiki writes them.
+    """
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('<table class="darktable zebra">\n  <tbody>\n  <tr>\n'
+                '    <th>Output</th>\n    <th>Input</th>\n  </tr>\n')
+        for row, module in enumerate(modules):
+            items = []
+            for name, run in itertools.groupby(module['resource_cost']):
+                count = len(list(run))
+                items.append(f'<span> <a>{html.escape(name)}</a></span>'
+                             + (f' x{count}' if count > 1 else ''))
+            cost = ("<br>".join(items) if row % 2 else
+                    items[0] + "".join(f"\n      <p>{item}\n      </p>" for item in items[1:])
+                    if items else "")
+            f.write(f'  <tr>\n    <td><span> <a>{html.escape(module["name"])}</a></span>\n'
+                    f'    </td>\n    <td>{cost}\n    </td>\n  </tr>\n')
+        f.write('  </tbody>\n</table>\n')
+
+
+@pytest.fixture(scope="module")
+def data_dir(catalog, tmp_path_factory):
+    """A data directory with the resources csv and one printing table per printer"""
+    path = tmp_path_factory.mktemp("data")
+    with open(path / data_files.RESOURCE_CSV, 'w', newline='', encoding='utf8') as f:
+        writer = csv.writer(f)
+        for r in catalog['resources']:
+            writer.writerow([r['name'], ', '.join(r['found']), ', '.join(r['crafted_in']),
+                             ', '.join(r['refined_with']), ', '.join(r['rate'])])
+    (path / data_files.PLANET_CSV).write_text('', encoding='utf8')
+    tables = len(data_files.PRINTING_TABLES)
+    for i, (name, _) in enumerate(data_files.PRINTING_TABLES):
+        write_printing_table(path / f"{name}.html", catalog['modules'][i::tables])
+    return path
+
+
+def test_ingest_everything(benchmark, data_dir):
+    def ingest_all():
+        pipeline = ingest.Pipeline(str(data_dir), server.BUILDERS)
+        pipeline.refresh()
+        return pipeline
+    pipeline = benchmark.pedantic(ingest_all, rounds=3)
+    assert pipeline.catalog()['modules']
+
+
+def test_ingest_reads_every_cost(data_dir, catalog):
+    pipeline = ingest.Pipeline(str(data_dir), server.BUILDERS)
+    pipeline.refresh()
+    costs = {m['name']: list(m['resource_cost']) for m in pipeline.catalog()['modules']}
+    assert costs == {m['name']: list(m['resource_cost']) for m in catalog['modules']}
+
+
+def test_ingest_unchanged(benchmark, data_dir):
+    pipeline = ingest.Pipeline(str(data_dir), server.BUILDERS)
+    pipeline.refresh()
+    assert benchmark(pipeline.refresh) == []
+
+
+def test_ingest_one_table_edited(benchmark, data_dir, catalog):
+    pipeline = ingest.Pipeline(str(data_dir), server.BUILDERS)
+    pipeline.refresh()
+    tables = len(data_files.PRINTING_TABLES)
+    name = data_files.PRINTING_TABLES[-1][0]
+    modules = catalog['modules'][tables - 1::tables]
+    edits = itertools.cycle([modules[:-1], modules])
+
+    def edit():
+        write_printing_table(data_dir / f"{name}.html", next(edits))
+    changes = benchmark.pedantic(pipeline.refresh, setup=edit, rounds=4)
+    assert len(changes) == 1
@@ -0,0 +1,23 @@
+"""Every API route reports the same latency phases at /metrics"""
+import re
+
+BASE = '/astro/v1'
+LABELS = re.compile(r'(\w+)="([^"]*)"')
+
+
+def test_every_route_times_the_write_phase(client, catalog):
+    name = catalog['resources'][0]['name']
+    for path in ('/Resources/', f"/Resources/{name}", '/Resources/?limit=2', '/Default/',
+                 '/Default/export', '/Planets/'):
+        assert client.get(BASE + path).status_code == 200
+    # aborted requests end before the write phase, so only routes answered here count
+    routes = {BASE + route for route in ('/Resources/', '/Resources/<string:name_id>',
+                                         '/Default/', '/Default/export', '/Planets/')}
+    phases = {}
+    for labels in re.findall(r'_count\{([^}]*)\}', client.get('/metrics').get_data(as_text=True)):
+        labels = dict(LABELS.findall(labels))
+        if labels.get('route') in routes:
+            phases.setdefault(labels['route'], set()).add(labels['phase'])
+    assert phases.keys() == routes
+    for route, seen in phases.items():
+        assert {'handler', 'write', 'total'} <= seen, route
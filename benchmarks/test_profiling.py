@@ -0,0 +1,50 @@
+"""The request profiler never fails or buffers the request it samples"""
+import threading
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+import server
+
+BASE = '/astro/v1'
+
+
+@pytest.fixture
+def profiling(monkeypatch):
+    monkeypatch.setitem(server.app.config, 'PROFILING', True)
+    server.PROFILER.clear()
+    yield server.PROFILER
+    server.PROFILER.clear()
+
+
+def test_concurrent_sampled_requests_are_served(client, catalog, profiling):
+    # pylint: disable=protected-access
+    results = []
+
+    def request():
+        response = client.get(f"{BASE}/Resources/{catalog['resources'][0]['name']}",
+                              headers={'X-Profile': '1'})
+        results.append(response.status_code)
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    with profiling._profiling:
+        # another request is being profiled: these go through unprofiled
+        request()
+        assert profiling.collapsed() == ''
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [200] * 9
+    assert 'Resources' in profiling.collapsed()
+
+
+def test_sampled_stream_is_passed_through(catalog, profiling):
+    environ = EnvironBuilder(f"{BASE}/Default/export", headers={'X-Profile': '1'}).get_environ()
+    started = []
+    body = profiling(environ, lambda status, headers, exc_info=None: started.append(status))
+    try:
+        assert not isinstance(body, list)
+        assert next(iter(body))
+    finally:
+        body.close()
+    assert started == ['200 OK']
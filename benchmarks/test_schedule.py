@@ -0,0 +1,100 @@
+"""Correctness tests of the production scheduler"""
+import pytest
+
+import server
+from crafting import CraftingResolver
+from schedule import ScheduleError, schedule
+from store import Collection
+
+BASE = '/astro/v1'
+
+
+def resolver(resources, modules=()):
+    resource_store, module_store = Collection(), Collection()
+    resource_store.add_many(resources)
+    module_store.add_many(modules)
+    return CraftingResolver(resource_store, module_store)
+
+
+def test_recipe_loop_is_refused():
+    loop = resolver([server.make_resource('A', [], ['Chemistry Lab'], ['B'], []),
+                     server.make_resource('B', [], ['Chemistry Lab'], ['A'], [])])
+    with pytest.raises(ScheduleError, match="crafted from itself"):
+        schedule(loop, {}, {'A': 1}, {'Chemistry Lab': 1}, {})
+
+
+def test_ingredient_used_twice_is_not_a_loop():
+    plan = resolver([server.make_resource('Ore', ['Sylva'], ['Drill'], [], []),
+                     server.make_resource('Plate', [], ['Smelting Furnace'], ['Ore'], []),
+                     server.make_resource('Rod', [], ['Smelting Furnace'], ['Plate'], []),
+                     server.make_resource('Frame', [], ['Chemistry Lab'], ['Plate', 'Rod'], [])])
+    makespan, steps = schedule(plan, {}, {'Frame': 1},
+                               {'Smelting Furnace': 1, 'Chemistry Lab': 1}, {})
+    assert sorted(step['item'] for step in steps) == ['Frame', 'Plate', 'Plate', 'Rod']
+    assert makespan == 4
+
+
+def test_each_machine_takes_its_own_duration():
+    plan = resolver([server.make_resource('Widget', [], ['Smelting Furnace', 'Chemistry Lab'],
+                                          ['Ore'], [])])
+    machines = {'Smelting Furnace': 1, 'Chemistry Lab': 1}
+    durations = {'Smelting Furnace': 10, 'Chemistry Lab': 1}
+    makespan, steps = schedule(plan, {}, {'Widget': 2}, machines, durations)
+    for step in steps:
+        assert step['end'] - step['start'] == durations[step['machine']]
+    # both on the lab beats one of them waiting 10 on the furnace
+    assert [step['machine'] for step in steps] == ['Chemistry Lab', 'Chemistry Lab']
+    assert makespan == 2
+    makespan, steps = schedule(plan, {}, {'Widget': 12}, machines, durations)
+    assert makespan == 11
+    assert [step['machine'] for step in steps].count('Smelting Furnace') == 1
+
+
+def test_too_many_crafts_is_refused():
+    plan = resolver([server.make_resource('Ore', ['Sylva'], ['Drill'], [], []),
+                     server.make_resource('Plate', [], ['Smelting Furnace'], ['Ore'], [])],
+                    [server.make_module('Tower', ['Plate', 'Plate'], 'Small Printer')])
+    machines = {'Smelting Furnace': 1, 'Small Printer': 1}
+    assert len(schedule(plan, {'Tower': 3}, {}, machines, {}, max_tasks=9)[1]) == 9
+    with pytest.raises(ScheduleError, match="more than 9 crafts"):
+        schedule(plan, {'Tower': 4}, {}, machines, {}, max_tasks=9)
+
+
+def test_huge_machine_counts_cost_nothing():
+    plan = resolver([server.make_resource('Plate', [], ['Smelting Furnace'], ['Ore'], [])])
+    makespan, steps = schedule(plan, {}, {'Plate': 3}, {'Smelting Furnace': 10 ** 12}, {})
+    assert makespan == 1
+    assert sorted(step['instance'] for step in steps) == [0, 1, 2]
+
+
+def test_endpoint_refuses_loops_and_huge_plans(client):
+    resources = server.DATABASE['resources']
+    resources.add_many([server.make_resource('Loop A', [], ['Chemistry Lab'], ['Loop B'], []),
+                        server.make_resource('Loop B', [], ['Chemistry Lab'], ['Loop A'], []),
+                        server.make_resource('Loop Ore', ['Sylva'], ['Drill'], [], []),
+                        server.make_resource('Loop Plate', [], ['Chemistry Lab'], ['Loop Ore'],
+                                             [])])
+    try:
+        response = client.post(f"{BASE}/schedule/", json={
+            'resources': {'Loop A': 1}, 'machines': {'Chemistry Lab': 1}})
+        assert response.status_code == 400
+        assert "crafted from itself" in response.json['message']
+        response = client.post(f"{BASE}/schedule/", json={
+            'resources': {'Loop Plate': 2}, 'machines': {'Chemistry Lab': 1}})
+        assert response.json['makespan'] == 2
+        response = client.post(f"{BASE}/schedule/", json={
+            'resources': {'Loop Plate': 10000000}, 'machines': {'Chemistry Lab': 1}})
+        assert response.status_code == 400
+        assert "crafts" in response.json['message']
+    finally:
+        for name in ('Loop A', 'Loop B', 'Loop Ore', 'Loop Plate'):
+            resources.delete(name)
+
+
+@pytest.mark.parametrize('duration', ['Infinity', 'NaN', '-1'])
+def test_endpoint_refuses_durations_that_are_not_finite(client, duration):
+    response = client.post(f"{BASE}/schedule/", content_type='application/json',
+                           data=f'{{"durations": {{"Chemistry Lab": {duration}}}}}')
+    assert response.status_code == 400
+    assert response.json['message'] == \
+        "durations for Chemistry Lab must be a non-negative number"
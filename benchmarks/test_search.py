@@ -0,0 +1,79 @@
+"""Correctness tests of the search index against a search reading every name"""
+import random
+
+import pytest
+
+import search
+import server
+import store
+from conftest import synthetic_catalog
+
+
+def brute_force(collections, query, limit, kinds):
+    """What SearchIndex.search answers, worked out name by name"""
+    key = search.normalize(query)
+    scores = {}
+    for kind in kinds or collections:
+        for record in collections[kind]:
+            name = search.normalize(record['name'])
+            words = name.split(' ')
+            if name == key:
+                scores[kind, record['name']] = search.EXACT
+            elif name.startswith(key):
+                scores[kind, record['name']] = search.PREFIX
+            elif any(' '.join(words[i:]).startswith(key) for i in range(1, len(words))):
+                scores[kind, record['name']] = search.WORD_PREFIX
+    if len(scores) < limit:
+        grams = search.trigrams(key)
+        for kind in kinds or collections:
+            for record in collections[kind]:
+                theirs = search.trigrams(search.normalize(record['name']))
+                similarity = 2 * len(grams & theirs) / (len(grams) + len(theirs))
+                if grams & theirs and similarity >= search.MIN_SIMILARITY:
+                    scores.setdefault((kind, record['name']), similarity)
+    ranked = sorted(scores.items(), key=lambda hit: (-hit[1], len(hit[0][1]), hit[0]))
+    return [(kind, name, round(score, 3)) for (kind, name), score in ranked[:limit]]
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    # every trigram used for finding names, and merges happening within the test
+    monkeypatch.setattr(search, 'MAX_POSTING', 10 ** 9)
+    monkeypatch.setattr(search, 'MERGE_MIN', 50)
+    data = synthetic_catalog(100)
+    collections = {'resource': store.Collection(), 'module': store.Collection()}
+    collections['resource'].add_many(data['resources'])
+    collections['module'].add_many(data['modules'])
+    return collections
+
+
+def test_search_matches_brute_force_through_writes(collections):
+    index = search.SearchIndex(collections)
+    rng = random.Random(7)
+    names = [record['name'] for collection in collections.values() for record in collection]
+    for _ in range(1000):
+        name = rng.choice(names)
+        if rng.random() < 0.2:
+            kind = 'resource' if collections['resource'].exists(name) else 'module'
+            if not collections[kind].exists(name):
+                collections['module'].add(server.make_module(name, [], 'Small Printer'))
+            elif rng.random() < 0.5:
+                collections[kind].delete(name)
+            else:
+                collections[kind].replace(name, {'name': f"{name} Mk2"})
+            continue
+        query = rng.choice([name[:rng.randint(1, 4)], name, name[:-1] + 'x',
+                            name.lower().replace('_', ' ')[rng.randint(0, 3):], 'a'])
+        limit = rng.choice([1, 5, 10, 40])
+        kinds = rng.choice([None, ['resource'], ['module']])
+        assert index.search(query, limit, kinds) == brute_force(collections, query, limit, kinds)
+
+
+def test_loading_through_listeners_is_one_build(collections):
+    empty = {kind: store.Collection() for kind in collections}
+    index = search.SearchIndex(empty)
+    for kind, collection in collections.items():
+        empty[kind].add_many(collection.all())
+    index.catch_up()
+    assert not index._pending  # pylint: disable=protected-access
+    assert index.search('alumin', 40) == brute_force(collections, 'alumin', 40, None)
@@ -0,0 +1,186 @@
+"""Correctness tests of the collection backends and the item endpoints reading them"""
+import threading
+
+import pytest
+
+import server
+import store
+from crafting import UsedByIndex
+
+BASE = '/astro/v1'
+
+
+def record(name, value=0):
+    return {'name': name, 'value': value}
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def collection(request, tmp_path):
+    if request.param == 'memory':
+        return store.Collection()
+    return store.open_collection(f"sqlite:///{tmp_path / 'catalog.db'}", 'things')
+
+
+def test_snapshot_does_not_see_later_writes(collection):
+    if collection.blocking:
+        pytest.skip("sqlite hands back the live collection")
+    collection.add_many([record('a'), record('b')])
+    before = collection.snapshot()
+    collection.replace('a', record('a', 1))
+    collection.delete('b')
+    collection.add(record('c'))
+    assert [r['name'] for r in before.all()] == ['a', 'b']
+    assert before.get('a')['value'] == 0
+    assert before.get('c') is None
+    assert [r['name'] for r in collection.snapshot().all()] == ['a', 'c']
+
+
+def test_rename_moves_to_the_end(collection):
+    collection.add_many([record('a'), record('b'), record('c')])
+    collection.replace('a', record('z'))
+    collection.replace('b', record('b', 1))
+    assert [r['name'] for r in collection.all()] == ['b', 'c', 'z']
+    assert not collection.exists('a')
+
+
+def test_paging_survives_writes(collection):
+    collection.add_many([record(str(i)) for i in range(10)])
+    page, cursor = collection.page(None, 4)
+    assert [r['name'] for r in page] == ['0', '1', '2', '3']
+    collection.delete('4')
+    collection.add(record('new'))
+    collection.replace('1', record('1', 1))
+    seen = [r['name'] for r in page]
+    while cursor is not None:
+        page, cursor = collection.page(cursor, 4)
+        seen += [r['name'] for r in page]
+    assert seen == ['0', '1', '2', '3', '5', '6', '7', '8', '9', 'new']
+
+
+def test_missing_names_raise_key_error(collection):
+    collection.add(record('a'))
+    with pytest.raises(KeyError):
+        collection.replace('b', record('b'))
+    with pytest.raises(KeyError):
+        collection.delete('b')
+    assert [r['name'] for r in collection.all()] == ['a']
+
+
+def test_failed_batch_writes_nothing():
+    collection = store.Collection()
+    collection.add(record('a'))
+    seen = []
+    collection.subscribe(lambda old, new: seen.append((old, new)))
+    version = collection.version
+    # pylint: disable=protected-access
+    with pytest.raises(KeyError):
+        collection._write([('a', record('a', 1)), ('missing', record('missing'))],
+                          must_exist=True)
+    assert collection.version == version
+    assert collection.get('a')['value'] == 0
+    assert seen == []
+    collection.add(record('b'))
+    assert [r['name'] for r in collection.all()] == ['a', 'b']
+
+
+def test_add_many_without_replace_writes_nothing_on_a_taken_name(collection):
+    collection.add(record('a'))
+    version = collection.version
+    with pytest.raises(store.AlreadyExists) as error:
+        collection.add_many([record('b'), record('a', 1)], replace=False)
+    assert error.value.names == ['a']
+    assert collection.version == version
+    assert [(r['name'], r['value']) for r in collection.all()] == [('a', 0)]
+    collection.add_many([record('b')], replace=False)
+    assert [r['name'] for r in collection.all()] == ['a', 'b']
+
+
+def test_write_many_is_one_snapshot(collection):
+    collection.add_many([record('a'), record('b')])
+    seen = []
+    collection.subscribe(lambda old, new: seen.append((old and old['name'], new and new['name'])))
+    collection.write_many([('a', None), ('b', record('b', 1)), ('c', record('c')),
+                           ('gone', None)])
+    assert seen == [('a', None), ('b', 'b'), (None, 'c')]
+    assert [(r['name'], r['value']) for r in collection.all()] == [('b', 1), ('c', 0)]
+    assert len(collection) == 2
+
+
+def test_log_is_compacted():
+    collection = store.Collection()
+    for i in range(500):
+        collection.add(record('a', i))
+        collection.replace('a', record(f"b{i}"))
+        collection.delete(f"b{i}")
+    snapshot = collection.snapshot()
+    assert len(snapshot) == 0
+    assert snapshot.log_len <= 2 * snapshot.count + 64 + 2
+    collection.add(record('last'))
+    assert [r['name'] for r in collection.all()] == ['last']
+
+
+def test_reset_racing_a_write_does_not_hang(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, 'CHANGE_LOG_LIMIT', 2)
+    url = f"sqlite:///{tmp_path / 'catalog.db'}"
+    mine = {kind: store.open_collection(url, kind) for kind in ('resources', 'modules')}
+    theirs = store.open_collection(url, 'resources')
+
+    def write_elsewhere(old, new):
+        # another worker commits while this one is rebuilding from the reset
+        if old is None and new is None:
+            theirs.add({'name': 'late', 'refined_with': []})
+    mine['resources'].subscribe(write_elsewhere)
+    index = UsedByIndex(mine['resources'], mine['modules'])
+    for i in range(5):
+        theirs.add({'name': f"r{i}", 'refined_with': ['Resin']})
+    # the log no longer reaches back to what this worker saw, so it gets a reset
+    reader = threading.Thread(target=index.used_by, args=('Resin',), daemon=True)
+    reader.start()
+    reader.join(10)
+    assert not reader.is_alive()
+    assert sorted(name for name, _ in index.used_by('Resin')['resources']) == [
+        f"r{i}" for i in range(5)]
+    assert mine['resources'].exists('late')
+
+
+def test_get_racing_a_delete_is_404(client, catalog, monkeypatch):
+    resource = catalog['resources'][0]
+    server.DATABASE['resources'].delete(resource['name'])
+    # exists() still answering true is a delete landing between two reads
+    monkeypatch.setattr(server.DATABASE['resources'], 'exists', lambda name: True)
+    try:
+        response = client.get(f"{BASE}/Resources/{resource['name']}")
+    finally:
+        server.DATABASE['resources'].add(resource)
+    assert response.status_code == 404
+    assert client.get(f"{BASE}/Resources/{resource['name']}").json['name'] == resource['name']
+
+
+def test_put_racing_a_delete_is_404(client, catalog, monkeypatch):
+    name = catalog['modules'][0]['name']
+
+    def deleted(old, new):
+        raise KeyError(old)
+    monkeypatch.setattr(server.DATABASE['modules'], 'replace', deleted)
+    response = client.put(f"{BASE}/Modules/{name}",
+                          data={'name': name, 'resource_cost': 'Resin', 'printer': 'Small Printer'})
+    assert response.status_code == 404
+    assert response.json['message'].startswith(f"Module {name} doesn't exist")
+
+
+def test_bulk_import_racing_a_post_is_rejected(client, catalog, monkeypatch):
+    name = catalog['resources'][0]['name']
+    # exists() answering false is a POST of the same name landing after the check
+    monkeypatch.setattr(server.DATABASE['resources'], 'exists', lambda name: False)
+    response = client.post(f"{BASE}/Resources/bulk",
+                           json=[{'name': 'Raced'}, {'name': name}])
+    monkeypatch.undo()
+    assert response.status_code == 400
+    assert response.json['message'] == "1 of 2 records rejected, nothing was imported"
+    assert response.json['errors'] == [{'index': 1, 'name': name,
+                                        'error': f"Resource {name} already exists"}]
+    assert not server.DATABASE['resources'].exists('Raced')
+
+
+def test_delete_missing_is_404(client, catalog):
+    assert client.delete(f"{BASE}/Resources/no such resource").status_code == 404
@@ -0,0 +1,128 @@
+"""Bill of materials for module shopping lists
+
+Each module's raw material cost (from the crafting resolver) becomes a sparse
+row of raw resource columns and counts, and the rows are packed CSR style
+into three flat arrays. The cost of any number of shopping lists is then one
+gather of the rows asked for and one np.add.at, instead of a recipe walk per
+item. A module costs a handful of raws out of thousands, so the packed rows
+take memory in proportion to the recipes rather than modules x raws.
+"""
+import threading
+
+import numpy as np
+
+
+class BomMatrix:
+    """Sparse module to raw resource requirements, repacked lazily after a write
+
+    Rows are kept per module between writes: a module write drops just that
+    module's row and a resource write drops them all, but then rebuilds them
+    from the resolver's memoized trees, which only lost what the write touched.
+    """
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self._lock = threading.Lock()
+        self._packed = None
+        # module name: (raw columns, counts)
+        self._rows = {}
+        # raw name: column, only ever appended to
+        self._raws = {}
+        self._generation = 0
+        resolver.resources.subscribe(self._resource_changed)
+        resolver.modules.subscribe(self._module_changed)
+
+    def _resource_changed(self, old, new):
+        self._generation += 1
+        self._packed = None
+        self._rows = {}
+
+    def _module_changed(self, old, new):
+        self._generation += 1
+        self._packed = None
+        if old is None and new is None:
+            self._rows = {}
+        for record in (old, new):
+            if record is not None:
+                self._rows.pop(record['name'], None)
+
+    def _row(self, name):
+        tree = self.resolver.module_tree(name)
+        if tree is None:
+            return None
+        columns = [self._raws.setdefault(raw, len(self._raws)) for raw in tree['raw']]
+        return (np.array(columns, dtype=np.int64),
+                np.fromiter(tree['raw'].values(), dtype=np.int64, count=len(columns)))
+
+    def matrix(self):
+        """({module: row}, raw names, indptr, columns, counts) as of the latest write
+
+        Row i's raw columns are columns[indptr[i]:indptr[i + 1]], needing the
+        counts at the same positions.
+        """
+        self.resolver.resources.sync()
+        self.resolver.modules.sync()
+        current = self._packed
+        if current is not None:
+            return current
+        with self._lock:
+            current = self._packed
+            if current is None:
+                generation = self._generation
+                kept, fresh = self._rows, {}
+                names, rows = {}, []
+                for module in self.resolver.modules.snapshot():
+                    name = module['name']
+                    row = kept.get(name) or fresh.get(name)
+                    if row is None:
+                        row = fresh[name] = self._row(name)
+                        if row is None:
+                            continue
+                    names[name] = len(rows)
+                    rows.append(row)
+                indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+                np.cumsum([len(columns) for columns, _ in rows], out=indptr[1:])
+                columns = np.concatenate([c for c, _ in rows]) if rows else np.zeros(0, np.int64)
+                counts = np.concatenate([n for _, n in rows]) if rows else np.zeros(0, np.int64)
+                for array in (indptr, columns, counts):
+                    array.setflags(write=False)
+                current = (names, tuple(self._raws), indptr, columns, counts)
+                # a write that landed mid build leaves the rows to be built again next time
+                if generation == self._generation:
+                    kept.update(fresh)
+                    self._packed = current
+            return current
+
+    def totals(self, shopping_lists):
+        """Raw resource totals for each {module: quantity} list
+
+        Raises KeyError naming the first module that doesn't exist.
+        """
+        names, raws, indptr, columns, counts = self.matrix()
+        list_ids, module_ids, quantities = [], [], []
+        for list_id, shopping_list in enumerate(shopping_lists):
+            for module, quantity in shopping_list.items():
+                if module not in names:
+                    raise KeyError(module)
+                list_ids.append(list_id)
+                module_ids.append(names[module])
+                quantities.append(quantity)
+        results = [{} for _ in shopping_lists]
+        if not module_ids:
+            return results
+        module_ids = np.array(module_ids, dtype=np.int64)
+        starts, lengths = indptr[module_ids], indptr[module_ids + 1] - indptr[module_ids]
+        # positions in columns/counts of every entry of every row asked for
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+        keys = np.repeat(np.array(list_ids, dtype=np.int64), lengths) * len(raws) \
+            + columns[positions]
+        cells, where = np.unique(keys, return_inverse=True)
+        sums = np.zeros(len(cells), dtype=np.int64)
+        np.add.at(sums, where,
+                  counts[positions] * np.repeat(np.array(quantities, dtype=np.int64), lengths))
+        for cell, total in zip(cells.tolist(), sums.tolist()):
+            if total:
+                list_id, column = divmod(cell, len(raws))
+                results[list_id][raws[column]] = total
+        return results
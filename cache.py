@@ -0,0 +1,79 @@
+"""Versioned response cache for the list endpoints"""
+import gzip
+import hashlib
+import threading
+
+import brotli
+
+# Content-Encodings a cached body is offered in, the first preferred when a client rates them
+# the same. These levels compress a 2.5 MB listing in about 0.1 s; brotli's top quality
+# takes 8 s for another 20%.
+ENCODERS = {
+    'br': lambda body: brotli.compress(body, quality=6),
+    'gzip': lambda body: gzip.compress(body, compresslevel=6, mtime=0),
+}
+
+
+class CachedBody:
+    """A serialized response body at a collection version
+
+    Compressed variants are made the first time a client asks for them and
+    kept with the body, so each is compressed at most once per version.
+    """
+
+    __slots__ = ('version', 'body', 'etag', '_variants', '_lock')
+
+    def __init__(self, version, body, etag):
+        self.version = version
+        self.body = body
+        self.etag = etag
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """(body, etag) compressed with one of ENCODERS, its etag told apart from the plain one"""
+        variant = self._variants.get(encoding)
+        if variant is None:
+            with self._lock:
+                variant = self._variants.get(encoding)
+                if variant is None:
+                    variant = (ENCODERS[encoding](self.body), f"{self.etag}-{encoding}")
+                    self._variants[encoding] = variant
+        return variant
+
+
+class ResponseCache:
+    """Serialized response bodies, one per key, tagged with the version they were built at
+
+    An entry is only served while the collection is still at that version, and
+    every write to a watched collection evicts its entry straight away so stale
+    bytes are never held on to.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def watch(self, kind, collection):
+        """Evict the entry for kind whenever collection is written to
+
+        An entry built from several collections watches each of them.
+        """
+        collection.subscribe(lambda old, new: self.evict(kind))
+
+    def get(self, kind, version):
+        """The cached body for kind, or None if there is none for this version"""
+        entry = self._entries.get(kind)
+        if entry is not None and entry.version == version:
+            return entry
+        return None
+
+    def put(self, kind, version, body):
+        """Store body for kind at version with a strong ETag derived from the bytes"""
+        etag = hashlib.sha1(body).hexdigest()
+        entry = CachedBody(version, body, etag)
+        self._entries[kind] = entry
+        return entry
+
+    def evict(self, kind):
+        """Drop the entry for kind"""
+        self._entries.pop(kind, None)
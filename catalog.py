@@ -0,0 +1,72 @@
+"""Catalog data files and the precompiled snapshot built from them"""
+import csv
+import os
+import pickle
+from collections import namedtuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+RESOURCE_CSV = 'resources.csv'
+PLANET_CSV = 'planets.csv'
+# each printing table lists the modules made in one printer, read from the wiki html when it's
+# there and from the hand-made csv copy otherwise
+PRINTING_TABLES = (('printing0', 'Backpack Printer'),
+                   ('printing1', 'Small Printer'),
+                   ('printing2', 'Medium Printer'),
+                   ('printing3', 'Large Printer'))
+SNAPSHOT = os.path.join(DATA_DIR, 'catalog.snapshot')
+SNAPSHOT_FORMAT = 3
+
+# name: unique source name, paths: the files it can be read from, first existing one wins,
+# printer: the printer of a printing table
+Source = namedtuple("Source", ["name", "kind", "paths", "printer"])
+
+
+def csv_rows(path):
+    """Rows of a catalog csv file, skipping `#` comment rows"""
+    with open(path, newline='', encoding='utf8') as f:
+        for row in csv.reader(f):
+            if row and not row[0].startswith('#'):
+                yield row
+
+
+def sources(data_dir=DATA_DIR):
+    """Every source of the catalog, in the order their records are merged
+
+    Resources come first: module costs are matched to their spelling.
+    """
+    found = [Source('resources', 'resources', (os.path.join(data_dir, RESOURCE_CSV),), None),
+             Source('planets', 'planets', (os.path.join(data_dir, PLANET_CSV),), None)]
+    for name, printer in PRINTING_TABLES:
+        found.append(Source(name, 'modules', (os.path.join(data_dir, name + '.html'),
+                                              os.path.join(data_dir, name + '.csv')), printer))
+    return found
+
+
+def source_paths(data_dir=DATA_DIR):
+    """Every file the catalog can be built from"""
+    return [path for source in sources(data_dir) for path in source.paths]
+
+
+def write_snapshot(path, state):
+    """Save the state of an ingest.Pipeline as a snapshot
+
+    Records are stored already split and stripped, next to the fingerprint
+    of the file each came from, so loading is a single unpickle and only
+    files edited since are parsed again. The file is written aside and
+    renamed into place so a worker starting up never reads half a snapshot.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump({'format': SNAPSHOT_FORMAT, 'sources': state}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    """Load the pipeline state saved by write_snapshot"""
+    with open(path, 'rb') as f:
+        snapshot = pickle.load(f)
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is snapshot format {snapshot.get('format')}, "
+                         f"expected {SNAPSHOT_FORMAT}; rebuild it")
+    return snapshot['sources']
@@ -0,0 +1,147 @@
+"""Change feed over the catalog collections
+
+Every write to a watched collection is appended to a bounded log under an
+increasing sequence number, so a client mirroring the catalog asks for the
+changes since the last number it saw instead of downloading every list
+again. A rename is logged as a delete of the old name and a put of the new.
+
+ChangeLog lives in this process and epoch names it. A cursor from another
+epoch (another worker, or before a restart), or older than the oldest
+change still kept, can't be caught up and the client has to resync.
+SharedChangeLog reads the log a SQLite store keeps itself, numbered across
+every worker sharing the database, so workers answer each other's cursors.
+"""
+import json
+import threading
+import uuid
+from collections import deque, namedtuple
+from itertools import islice
+
+# record is None for a delete
+Change = namedtuple("Change", ["seq", "kind", "name", "record"])
+
+
+class ResyncRequired(Exception):
+    """The changes after a cursor are no longer in the log"""
+
+
+class ChangeLog:
+    """The last size changes made to the watched collections, numbered from 1"""
+
+    def __init__(self, size):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self._entries = deque(maxlen=size)
+        # cursors below this predate a reset and can't be caught up
+        self._floor = 0
+        self._changed = threading.Condition()
+
+    def watch(self, kind, collection):
+        """Log every write to collection under kind"""
+        collection.subscribe(lambda old, new: self._append(kind, old, new))
+
+    def _append(self, kind, old, new):
+        with self._changed:
+            if old is None and new is None:
+                # the whole collection changed at once, which the log can't replay
+                self.seq += 1
+                self._entries.clear()
+                self._floor = self.seq
+            else:
+                if old is not None and (new is None or new['name'] != old['name']):
+                    self.seq += 1
+                    self._entries.append(Change(self.seq, kind, old['name'], None))
+                if new is not None:
+                    self.seq += 1
+                    self._entries.append(Change(self.seq, kind, new['name'], new))
+            self._changed.notify_all()
+
+    def since(self, seq, limit=None, epoch=None):
+        """(changes after seq, oldest first, up to limit; cursor to pass next time)
+
+        Raises ResyncRequired when seq isn't a cursor of this log or some of
+        the changes after it were evicted, and ValueError when seq is ahead
+        of the log.
+        """
+        with self._changed:
+            oldest = self._entries[0].seq if self._entries else self.seq + 1
+            if epoch is not None and epoch != self.epoch:
+                raise ResyncRequired(seq)
+            check_ahead(seq, self.seq)
+            if seq < max(self._floor, oldest - 1):
+                raise ResyncRequired(seq)
+            start = seq + 1 - oldest
+            stop = None if limit is None else start + limit
+            changes = list(islice(self._entries, start, stop))
+        return changes, changes[-1].seq if changes else seq
+
+    def wait(self, seq, timeout):
+        """Block until there are changes after seq, or for timeout seconds"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.seq > seq, timeout)
+
+
+class SharedChangeLog:
+    """The change log of the store.SqliteCollection collections sharing one database
+
+    The store numbers every write as it commits it, so the cursor and epoch
+    are the database's rather than this process's. watch only wakes waiters
+    when a collection sees a write, its own or, on sync, another worker's.
+    """
+
+    def __init__(self, collections):
+        self.collections = dict(collections)
+        self._store = next(iter(self.collections.values()))
+        self.epoch = self._store.feed()[0]
+        self._changed = threading.Condition()
+
+    @property
+    def seq(self):
+        """The number of the last change written by any worker"""
+        return self._store.feed()[1]
+
+    def watch(self, kind, collection):
+        """Wake waiters on every write to collection; the store logs it already"""
+        collection.subscribe(lambda old, new: self._notify())
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def since(self, seq, limit=None, epoch=None):
+        """(changes after seq, oldest first, up to limit; cursor to pass next time)
+
+        Raises ResyncRequired when seq is from another database or some of
+        the changes after it were trimmed from the log, and ValueError when
+        seq is ahead of the log.
+        """
+        current, last, floor, rows = self._store.changes_after(seq, limit)
+        if epoch is not None and epoch != current:
+            raise ResyncRequired(seq)
+        check_ahead(seq, last)
+        if seq < floor:
+            raise ResyncRequired(seq)
+        changes = []
+        for number, kind, old, new in rows:
+            old = json.loads(old) if old is not None else None
+            new = self.collections[kind].record(json.loads(new)) if new is not None else None
+            if old is not None and (new is None or new['name'] != old['name']):
+                # a rename's put is numbered one after its delete
+                deleted = number - 1 if new is not None else number
+                if deleted > seq:
+                    changes.append(Change(deleted, kind, old['name'], None))
+            if new is not None:
+                changes.append(Change(number, kind, new['name'], new))
+        changes = changes[:limit]
+        return changes, changes[-1].seq if changes else seq
+
+    def wait(self, seq, timeout):
+        """Block until there are changes after seq, or for timeout seconds"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.seq > seq, timeout)
+
+
+def check_ahead(seq, last):
+    """Raise ValueError for a cursor past the last change, which no log handed out"""
+    if seq > last:
+        raise ValueError(f"Cursor {seq} is ahead of the change log, which ends at {last}")
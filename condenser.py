@@ -0,0 +1,113 @@
+"""Atmospheric Condenser collection rates as a planet x gas matrix
+
+A resource's rate list reads like ["Sylva:75", "Calidor:50"]. The strings are
+parsed once when the resource is written, and queries run over a dense numpy
+matrix rebuilt lazily after a change. Rates are read as units per minute.
+"""
+import threading
+
+import numpy as np
+
+
+def parse_rates(rate):
+    """["Sylva:75", ...] to {"Sylva": 75.0, ...}, skipping entries that aren't planet:number"""
+    rates = {}
+    for entry in rate:
+        planet, _, value = entry.partition(':')
+        try:
+            rates[planet.strip()] = float(value)
+        except ValueError:
+            continue
+    return rates
+
+
+class RateMatrix:
+    """Condenser rates for every gas on every planet
+
+    matrix() returns an immutable (planets, gases, rates) triple where
+    rates[p, g] is the rate of gas g on planet p, 0 where it can't be
+    collected.
+    """
+
+    def __init__(self, resources):
+        self.resources = resources
+        self._rates = {}
+        self._lock = threading.Lock()
+        self._matrix = None
+        for resource in resources:
+            self._update(None, resource)
+        resources.subscribe(self._changed)
+
+    def _update(self, old, new):
+        if old is not None:
+            self._rates.pop(old['name'], None)
+        if new is not None:
+            rates = parse_rates(new['rate'])
+            if rates:
+                self._rates[new['name']] = rates
+        self._matrix = None
+
+    def _changed(self, old, new):
+        with self._lock:
+            if old is None and new is None:
+                self._rates.clear()
+                for resource in self.resources:
+                    self._update(None, resource)
+            else:
+                self._update(old, new)
+
+    def matrix(self):
+        """(planets, gases, rates) as of the latest write"""
+        self.resources.sync()
+        current = self._matrix
+        if current is not None:
+            return current
+        with self._lock:
+            if self._matrix is None:
+                gases = tuple(self._rates)
+                planets = tuple(sorted({planet for rates in self._rates.values()
+                                        for planet in rates}))
+                rows = {planet: i for i, planet in enumerate(planets)}
+                rates = np.zeros((len(planets), len(gases)))
+                for g, gas in enumerate(gases):
+                    for planet, rate in self._rates[gas].items():
+                        rates[rows[planet], g] = rate
+                rates.setflags(write=False)
+                self._matrix = (planets, gases, rates)
+            return self._matrix
+
+    def rank(self, gas):
+        """[(planet, rate), ...] for every planet the gas can be collected on, fastest first
+
+        Raises KeyError for an unknown gas.
+        """
+        planets, gases, rates = self.matrix()
+        column = rates[:, gases.index(gas)] if gas in gases else None
+        if column is None:
+            raise KeyError(gas)
+        order = np.argsort(-column, kind='stable')
+        return [(planets[p], float(column[p])) for p in order if column[p] > 0]
+
+    def collection_times(self, amounts):
+        """Minutes one condenser needs to collect {gas: units} on each planet
+
+        Returns [(planet, minutes), ...] fastest first, with None for planets
+        missing one of the gases. Raises KeyError for an unknown gas.
+        """
+        planets, gases, rates = self.matrix()
+        unknown = [gas for gas in amounts if gas not in gases]
+        if unknown:
+            raise KeyError(', '.join(unknown))
+        columns = rates[:, [gases.index(gas) for gas in amounts]]
+        wanted = np.array(list(amounts.values()), dtype=float)
+        with np.errstate(divide='ignore'):
+            times = np.where(columns > 0, wanted / columns, np.inf).sum(axis=1)
+        order = np.argsort(times, kind='stable')
+        return [(planets[p], float(times[p]) if np.isfinite(times[p]) else None) for p in order]
+
+    def best_planet(self, amounts):
+        """(planet, minutes) for the single planet quickest to collect {gas: units}, or None"""
+        times = self.collection_times(amounts)
+        if not times or times[0][1] is None:
+            return None
+        return times[0]
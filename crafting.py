@@ -0,0 +1,257 @@
+"""Crafting tree resolution for resources and modules"""
+import threading
+from collections import defaultdict
+
+
+def count_names(names):
+    """Collapse a list of names into {name: count}, keeping first-seen order"""
+    counts = {}
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def is_raw(resource):
+    """Raw materials are found on a planet or have nothing to refine them from
+
+    Unknown names (Scrap, typos in the printer csvs) are treated as raw too so
+    a tree always bottoms out.
+    """
+    return resource is None or bool(resource['found']) or not resource['refined_with']
+
+
+class CraftingResolver:
+    """Expands modules and resources down to raw materials
+
+    The recipe graph follows the collections through their listeners. Every
+    expanded sub-tree is memoized, and a write only evicts the node it touched
+    plus the resources and modules that are crafted from it.
+
+    Each eviction bumps a generation counter; an expansion that started
+    before the latest eviction is returned but not memoized, so a reader
+    racing a writer can't put a stale tree back in the memo.
+    """
+
+    def __init__(self, resources, modules):
+        self.resources = resources
+        self.modules = modules
+        self._recipes = {}
+        self._resource_parents = defaultdict(set)
+        self._module_parents = defaultdict(set)
+        self._resource_memo = {}
+        self._module_memo = {}
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._rebuild()
+        resources.subscribe(self._resource_changed)
+        modules.subscribe(self._module_changed)
+
+    def _recipe(self, resource):
+        if is_raw(resource):
+            return {}
+        return count_names(resource['refined_with'])
+
+    def recipe(self, name):
+        """{ingredient: quantity} to craft one unit of a resource, empty for raw materials"""
+        self.resources.sync()
+        return self._recipes.get(name, {})
+
+    def _rebuild(self):
+        self._generation += 1
+        self._recipes.clear()
+        self._resource_parents.clear()
+        self._module_parents.clear()
+        self._resource_memo.clear()
+        self._module_memo.clear()
+        for resource in self.resources:
+            self._apply_resource(None, resource)
+        for module in self.modules:
+            self._apply_module(None, module)
+
+    def _resource_changed(self, old, new):
+        with self._lock:
+            self._generation += 1
+            self._apply_resource(old, new)
+
+    def _apply_resource(self, old, new):
+        if old is None and new is None:
+            self._rebuild()
+            return
+        names = set()
+        if old is not None:
+            names.add(old['name'])
+            for ingredient in self._recipes.pop(old['name'], {}):
+                self._resource_parents[ingredient].discard(old['name'])
+        if new is not None:
+            names.add(new['name'])
+            recipe = self._recipe(new)
+            self._recipes[new['name']] = recipe
+            for ingredient in recipe:
+                self._resource_parents[ingredient].add(new['name'])
+        for name in names:
+            self._invalidate(name)
+
+    def _module_changed(self, old, new):
+        with self._lock:
+            self._generation += 1
+            self._apply_module(old, new)
+
+    def _apply_module(self, old, new):
+        if old is None and new is None:
+            self._rebuild()
+            return
+        for module in (old, new):
+            if module is None:
+                continue
+            self._module_memo.pop(module['name'], None)
+            for ingredient in module['resource_cost']:
+                if module is old:
+                    self._module_parents[ingredient].discard(module['name'])
+                else:
+                    self._module_parents[ingredient].add(module['name'])
+
+    def _invalidate(self, name):
+        """Evict name and every ancestor that was expanded through it"""
+        stack, seen = [name], set()
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            self._resource_memo.pop(current, None)
+            for module in self._module_parents.get(current, ()):
+                self._module_memo.pop(module, None)
+            stack.extend(self._resource_parents.get(current, ()))
+
+    def _remember(self, memo, name, value, generation):
+        with self._lock:
+            if generation == self._generation:
+                memo[name] = value
+
+    def _expand(self, name, visiting, generation):
+        """(tree, raw totals, cacheable) for one unit of the resource called name"""
+        memoized = self._resource_memo.get(name)
+        if memoized is not None:
+            return memoized + (True,)
+        resource = self.resources.get(name)
+        recipe = self._recipes.get(name, {})
+        # a recipe loop is cut here and the node reported as raw, but nothing
+        # above the cut is memoized since the answer depends on the entry point
+        cacheable = name not in visiting
+        if not cacheable:
+            recipe = {}
+        tree = {
+            'name': name,
+            'crafted_in': resource['crafted_in'] if resource else [],
+            'raw': not recipe,
+            'ingredients': [],
+        }
+        raw = {} if recipe else {name: 1}
+        visiting.add(name)
+        for ingredient, quantity in recipe.items():
+            subtree, subtotal, complete = self._expand(ingredient, visiting, generation)
+            cacheable = cacheable and complete
+            tree['ingredients'].append({'quantity': quantity, 'resource': subtree})
+            for leaf, count in subtotal.items():
+                raw[leaf] = raw.get(leaf, 0) + count * quantity
+        visiting.discard(name)
+        if cacheable:
+            self._remember(self._resource_memo, name, (tree, raw), generation)
+        return tree, raw, cacheable
+
+    def resource_tree(self, name):
+        """Crafting tree and raw totals for one unit of a resource"""
+        self.resources.sync()
+        tree, raw, _ = self._expand(name, set(), self._generation)
+        return {'name': name, 'tree': tree, 'raw': raw}
+
+    def module_tree(self, name):
+        """Crafting tree and raw totals for printing a module, None if there is no such module"""
+        self.resources.sync()
+        self.modules.sync()
+        generation = self._generation
+        memoized = self._module_memo.get(name)
+        if memoized is not None:
+            return memoized
+        module = self.modules.get(name)
+        if module is None:
+            return None
+        tree = {
+            'name': name,
+            'printer': module['printer'],
+            'ingredients': [],
+        }
+        raw, cacheable = {}, True
+        for ingredient, quantity in count_names(module['resource_cost']).items():
+            subtree, subtotal, complete = self._expand(ingredient, set(), generation)
+            cacheable = cacheable and complete
+            tree['ingredients'].append({'quantity': quantity, 'resource': subtree})
+            for leaf, count in subtotal.items():
+                raw[leaf] = raw.get(leaf, 0) + count * quantity
+        result = {'name': name, 'tree': tree, 'raw': raw}
+        if cacheable:
+            self._remember(self._module_memo, name, result, generation)
+        return result
+
+
+class UsedByIndex:
+    """Which resources and modules are made from a given resource
+
+    Every write updates only the entries of the record written, so a lookup
+    costs the size of its answer however big the catalog grows.
+    """
+
+    def __init__(self, resources, modules):
+        self.resources = resources
+        self.modules = modules
+        self._resources = defaultdict(dict)
+        self._modules = defaultdict(dict)
+        self._lock = threading.Lock()
+        self._rebuild()
+        resources.subscribe(self._resource_changed)
+        modules.subscribe(self._module_changed)
+
+    @staticmethod
+    def _move(index, old, new, field):
+        if old is not None:
+            for ingredient in count_names(old[field]):
+                users = index.get(ingredient)
+                if users is not None:
+                    users.pop(old['name'], None)
+                    if not users:
+                        del index[ingredient]
+        if new is not None:
+            for ingredient, quantity in count_names(new[field]).items():
+                index[ingredient][new['name']] = quantity
+
+    def _rebuild(self):
+        self._resources.clear()
+        self._modules.clear()
+        for resource in self.resources:
+            self._move(self._resources, None, resource, 'refined_with')
+        for module in self.modules:
+            self._move(self._modules, None, module, 'resource_cost')
+
+    def _resource_changed(self, old, new):
+        with self._lock:
+            if old is None and new is None:
+                self._rebuild()
+            else:
+                self._move(self._resources, old, new, 'refined_with')
+
+    def _module_changed(self, old, new):
+        with self._lock:
+            if old is None and new is None:
+                self._rebuild()
+            else:
+                self._move(self._modules, old, new, 'resource_cost')
+
+    def used_by(self, name):
+        """{'resources': [(name, quantity), ...], 'modules': [(name, quantity), ...]} using name"""
+        self.resources.sync()
+        self.modules.sync()
+        with self._lock:
+            return {
+                'resources': list(self._resources.get(name, {}).items()),
+                'modules': list(self._modules.get(name, {}).items()),
+            }
@@ -0,0 +1,370 @@
+"""Incremental catalog ingestion from the data directory
+
+Every source in catalog.sources() is fingerprinted by a hash of its
+content, and every record is remembered against the text of the row it was
+built from. refresh() reads again only the files whose hash changed, parses
+only the rows of those it hasn't seen, and returns just the records that
+changed, so a one-row edit costs a scan of one file and a few index updates
+instead of a rebuild.
+
+Printing tables are streamed out of the wiki html (data/printing*.html)
+with html.parser, or read from the hand-made csv copy when there is no
+html. Both go through the same clean up: whitespace collapsed, notes such
+as "(full)" dropped, "x2" quantities expanded to repeated names, and cost
+names matched to the spelling resources.csv uses, so the wiki's
+"Tungsten Carbide" is the catalog's Tungsten_Carbide.
+"""
+import hashlib
+import os
+import re
+import threading
+from html.parser import HTMLParser
+
+import catalog
+from search import normalize
+
+CHUNK = 1 << 16
+QUANTITY = re.compile(r'x(\d+)')
+ROW_START = re.compile(r'<tr[\s>/]', re.IGNORECASE)
+NOTE = re.compile(r'\s*\([^)]*\)$')
+# header titles of the name and cost columns of a printing table
+NAME_COLUMNS = ('Output', 'Name')
+COST_COLUMNS = ('Input', 'Recipe')
+# tags starting a new line of a table cell where they open or close
+LINE_BREAKS = frozenset({'br', 'p', 'div', 'li'})
+
+
+def fingerprint(path):
+    """Hex digest of a file's content, None when there is no such file"""
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def clean_name(text):
+    """text with its whitespace collapsed and a trailing note such as "(full)" dropped"""
+    return NOTE.sub('', ' '.join(text.split()))
+
+
+def expand_costs(items):
+    """Cost items to one name per unit: "Compound x2", or "x2" after Compound, is Compound twice"""
+    names = []
+    for item in items:
+        words = item.split()
+        count = 1
+        if words and QUANTITY.fullmatch(words[-1]):
+            count = int(words.pop()[1:])
+        if words:
+            names.append(clean_name(' '.join(words)))
+        if names:
+            names += [names[-1]] * (count - 1)
+    return names
+
+
+class TableParser(HTMLParser):
+    """Collects the rows of html tables as each one closes
+
+    rows holds (header, cells) pairs, header being true for a row of th
+    cells only. A cell is the list of its non-empty lines, split at <br>
+    and at block tags such as <p>.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None
+        self._cell = None
+        self._header = True
+
+    def _close_cell(self):
+        if self._cell is not None:
+            lines = (' '.join(line.split()) for line in self._cell)
+            self._row.append([line for line in lines if line])
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.rows.append((self._header and bool(self._row), self._row))
+            self._row = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._close_row()
+            self._row, self._header = [], True
+        elif tag in ('td', 'th') and self._row is not None:
+            self._close_cell()
+            self._cell = ['']
+            self._header = self._header and tag == 'th'
+        elif tag in LINE_BREAKS and self._cell is not None:
+            self._cell.append('')
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th'):
+            self._close_cell()
+        elif tag in LINE_BREAKS and self._cell is not None:
+            self._cell.append('')
+        elif tag in ('tr', 'table'):
+            self._close_row()
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell[-1] += data
+
+    def close(self):
+        super().close()
+        self._close_row()
+
+
+def parse_row(text):
+    """(header, cells) of the table row in text, None when there is none"""
+    parser = TableParser()
+    parser.feed(text)
+    parser.close()
+    return parser.rows[0] if parser.rows else None
+
+
+def html_row_texts(path):
+    """The source text of every table row of an html file, from its <tr up to the next one
+
+    The file is read a chunk at a time, so only the row being cut out is
+    held besides the chunk.
+    """
+    pending = ''
+    with open(path, encoding='utf8') as f:
+        for chunk in iter(lambda: f.read(CHUNK), ''):
+            pending += chunk
+            starts = [match.start() for match in ROW_START.finditer(pending)]
+            for begin, end in zip(starts, starts[1:]):
+                yield pending[begin:end]
+            # keep a tail that could be the start of a tag split across chunks
+            pending = pending[starts[-1]:] if starts else pending[-3:]
+    if ROW_START.match(pending):
+        yield pending
+
+
+def _column(titles, wanted):
+    return next((titles.index(title) for title in wanted if title in titles), None)
+
+
+def printing_html_rows(path, printer, known):
+    """(key, make_module arguments) for every row of a wiki printing table
+
+    Rows whose key is in known aren't parsed again and come with None
+    arguments. The key is the row's text plus where its name and cost
+    columns are, so the same text under other headers is a new row.
+    """
+    columns = (None, None)
+    for text in html_row_texts(path):
+        key = (text, columns)
+        if key in known:
+            yield key, None
+            continue
+        row = parse_row(text)
+        if row is None:
+            continue
+        header, cells = row
+        if header:
+            titles = [' '.join(cell) for cell in cells]
+            columns = (_column(titles, NAME_COLUMNS), _column(titles, COST_COLUMNS))
+            continue
+        name_at, cost_at = columns
+        if name_at is not None and cost_at is not None and len(cells) > max(name_at, cost_at):
+            name = clean_name(' '.join(cells[name_at]))
+            if name:
+                yield key, (name, expand_costs(cells[cost_at]), printer)
+
+
+def printing_csv_rows(path, printer):
+    """(key, make_module arguments) for every row of a printing csv, costs split at spaces"""
+    for r in catalog.csv_rows(path):
+        yield tuple(r), (clean_name(r[0]), expand_costs(r[1].split(' ')), printer)
+
+
+def source_rows(source, path, known):
+    """(key, builder arguments) for every row of one source file
+
+    The key stands for the row's text: rows with the same key build the
+    same record. Arguments may be None for a key in known.
+    """
+    if source.kind != 'modules':
+        width = 5 if source.kind == 'resources' else 6
+        return ((row, row) for row in (tuple(r[:width]) for r in catalog.csv_rows(path)))
+    if path.endswith('.html'):
+        return printing_html_rows(path, source.printer, known)
+    return printing_csv_rows(path, source.printer)
+
+
+class Pipeline:
+    """The catalog read from a data directory, kept current by refresh()
+
+    build maps each kind to the function making a record from a row's
+    arguments (server.make_resource and friends). state is what state()
+    returned before, to start from a snapshot instead of from nothing.
+
+    Besides each source's fingerprint the pipeline keeps the record every
+    row key built, so a file that changed is cut into rows again but only
+    its new rows are parsed, and unchanged rows keep their record objects.
+    """
+
+    def __init__(self, data_dir, build, state=None):
+        self.data_dir = data_dir
+        self.build = build
+        self.sources = catalog.sources(data_dir)
+        # source name: (fingerprint, {record name: record}, {row key: record})
+        self._held = {}
+        for name, (digest, rows) in (state or {}).items():
+            self._held[name] = (digest, {record['name']: record for record in rows.values()},
+                                rows)
+        self._aliases = self._resource_aliases()
+
+    def state(self):
+        """{source name: (fingerprint, {row key: record})}, for catalog.write_snapshot"""
+        return {name: (digest, rows) for name, (digest, _, rows) in self._held.items()}
+
+    def catalog(self):
+        """{kind: [record, ...]} merged over every source, later sources winning on a name"""
+        merged = {}
+        for source in self.sources:
+            held = self._held.get(source.name)
+            if held is not None:
+                merged.setdefault(source.kind, {}).update(held[1])
+        return {kind: list(records.values()) for kind, records in merged.items()}
+
+    def refresh(self):
+        """Read the sources that changed, returning what changed as [(kind, old, new), ...]
+
+        old is None for a record new to the catalog and new is None for one
+        no source has any more. A source whose files are all missing keeps
+        what it last gave, so a deployment can ship the snapshot alone.
+        """
+        changes = []
+        respell = False
+        for source in self.sources:
+            path = next((path for path in source.paths if os.path.exists(path)), None)
+            digest = fingerprint(path) if path else None
+            if digest is None:
+                continue
+            digest = (os.path.basename(path), digest)
+            held = self._held.get(source.name)
+            stale = respell and source.kind == 'modules'
+            if held is not None and held[0] == digest and not stale:
+                continue
+            known = held[2] if held is not None and not stale else {}
+            records, rows = {}, {}
+            for key, row in source_rows(source, path, known):
+                record = known.get(key)
+                if record is None:
+                    record = self._make(source.kind, row)
+                rows[key] = record
+                records[record['name']] = record
+            changes += self._swap(source, (digest, records, rows))
+            if source.kind == 'resources':
+                aliases = self._resource_aliases()
+                respell = respell or aliases != self._aliases
+                self._aliases = aliases
+        return changes
+
+    def _resource_aliases(self):
+        """{normalized name: name} of every resource, for matching module costs"""
+        aliases = {}
+        for source in self.sources:
+            if source.kind == 'resources' and source.name in self._held:
+                aliases.update((normalize(name), name) for name in self._held[source.name][1])
+        return aliases
+
+    def _make(self, kind, row):
+        if kind == 'modules':
+            name, cost, printer = row
+            row = (name, [self._aliases.get(normalize(x), x) for x in cost], printer)
+        return self.build[kind](*row)
+
+    def _winner(self, kind, name):
+        """The record called name from the last source of kind that has one"""
+        for source in reversed(self.sources):
+            if source.kind == kind and source.name in self._held:
+                record = self._held[source.name][1].get(name)
+                if record is not None:
+                    return record
+        return None
+
+    def _swap(self, source, held):
+        """Hold a source's new (fingerprint, records, rows), returning the changes it makes"""
+        old = self._held.get(source.name, (None, {}, {}))[1]
+        records = held[1]
+        # a record object kept from an unchanged row can't change the merge
+        touched = [name for name, record in records.items() if old.get(name) is not record]
+        touched += [name for name in old if name not in records]
+        before = [self._winner(source.kind, name) for name in touched]
+        self._held[source.name] = held
+        changes = []
+        for name, was in zip(touched, before):
+            now = self._winner(source.kind, name)
+            if now is not was and now != was:
+                changes.append((source.kind, was, now))
+        return changes
+
+
+class Watcher:
+    """Calls on_change from a background thread after files change
+
+    paths are checked with os.stat every interval seconds, which costs far
+    less than hashing them. on_change runs once a change has held still for
+    a whole interval, so a file caught half written is read after it
+    settles, and once more on the first check to catch edits made before
+    the watcher started. An exception from on_change goes to on_error and
+    waits for the next change.
+    """
+
+    def __init__(self, paths, interval, on_change, on_error):
+        self.paths = list(paths)
+        self.interval = interval
+        self.on_change = on_change
+        self.on_error = on_error
+        self._stop = threading.Event()
+        self._thread = None
+
+    def signature(self):
+        """(mtime, size, inode) of every path, None for a missing one"""
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        return tuple(signature)
+
+    def start(self):
+        """Start watching, unless already started"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="catalog-watcher",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop watching and wait for a change being applied to finish"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        applied, seen = None, self.signature()
+        while not self._stop.wait(self.interval):
+            current = self.signature()
+            if current != seen:
+                seen = current
+                continue
+            if current != applied:
+                applied = current
+                try:
+                    self.on_change()
+                except Exception as error:  # pylint: disable=broad-except
+                    self.on_error(error)
@@ -0,0 +1,252 @@
+"""Request latency histograms and counters in Prometheus text format
+
+Every thread records into its own shard, so observing a request never takes a
+lock; a scrape merges the shards. Shards of threads that have exited are folded
+into one retired shard, and series are keyed by route template rather than URL,
+so memory stays bounded however long the server runs.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+import flask
+from flask_restx import Api
+from flask_restx.reqparse import RequestParser
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Response
+
+# upper bounds in seconds; a last +Inf bucket catches the rest
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_SECONDS = 'astro_request_seconds'
+RESPONSES = 'astro_responses_total'
+ABORTS = 'astro_aborts_total'
+
+
+class _Shard:
+    """One thread's series: histograms as [count per bucket..., sum], counters as ints"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def merge(self, other):
+        for key, slot in other.histograms.items():
+            mine = self.histograms.setdefault(key, [0] * len(slot[:-1]) + [0.0])
+            for i, value in enumerate(slot):
+                mine[i] += value
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Recorder:
+    """Thread sharded histograms and counters
+
+    Series are (name, labels) where labels is a tuple of (label, value) pairs.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._help = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = _Shard()
+
+    def describe(self, name, kind, text):
+        """Set the TYPE (histogram or counter) and HELP lines of a metric"""
+        self._help[name] = (kind, text)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire(self):
+        """Fold the shards of exited threads into the retired shard; hold the lock"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._retired.merge(shard)
+        self._shards = live
+
+    def observe(self, name, labels, seconds):
+        """Add one observation to a histogram"""
+        histograms = self._shard().histograms
+        slot = histograms.get((name, labels))
+        if slot is None:
+            slot = histograms[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+        slot[bisect_left(self.buckets, seconds)] += 1
+        slot[-1] += seconds
+
+    def count(self, name, labels, amount=1):
+        """Add to a counter"""
+        counters = self._shard().counters
+        counters[(name, labels)] = counters.get((name, labels), 0) + amount
+
+    def merged(self):
+        """A _Shard summing every thread's series"""
+        total = _Shard()
+        with self._lock:
+            self._retire()
+            total.merge(self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            # dict() and list() copies are single steps under the GIL, so the
+            # owning thread adding a series mid scrape can't break the merge
+            copy = _Shard()
+            copy.histograms = {key: list(slot) for key, slot in dict(shard.histograms).items()}
+            copy.counters = dict(shard.counters)
+            total.merge(copy)
+        return total
+
+    def render(self):
+        """Every series in the Prometheus text exposition format"""
+        total = self.merged()
+        series = {}
+        for (name, labels), slot in total.histograms.items():
+            series.setdefault(name, []).append((labels, slot))
+        for (name, labels), value in total.counters.items():
+            series.setdefault(name, []).append((labels, value))
+        lines = []
+        for name in sorted(series):
+            kind, text = self._help.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(series[name], key=lambda item: item[0]):
+                if not isinstance(value, list):
+                    lines.append(f'{name}{_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {value[-1]}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def phase(name):
+    """Time a block into the current request's phase totals; a no-op outside a request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if flask.has_app_context():
+            phases = flask.g.get('astro_phases')
+            if phases is not None:
+                phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+class TimedRequestParser(RequestParser):
+    """RequestParser timing parse_args as the parse phase"""
+
+    def parse_args(self, req=None, strict=False):
+        with phase('parse'):
+            return super().parse_args(req, strict)
+
+
+class InstrumentedApi(Api):
+    """Api recording latency per route and method, split into phases
+
+    parse is reqparse argument parsing, marshal is marshal_with (or a block
+    timed with phase('marshal')), write is turning the result into a response,
+    and handler is whatever time is left. total covers the whole view.
+    """
+
+    def __init__(self, app=None, recorder=None, **kwargs):
+        self.recorder = recorder if recorder is not None else Recorder()
+        self.recorder.describe(REQUEST_SECONDS, 'histogram',
+                               'Time spent serving requests, by route, method and phase')
+        self.recorder.describe(RESPONSES, 'counter', 'Responses by route, method and status')
+        self.recorder.describe(ABORTS, 'counter', 'Requests aborted by an existence check')
+        super().__init__(app, **kwargs)
+
+    def parser(self):
+        """A TimedRequestParser"""
+        return TimedRequestParser()
+
+    def marshal_with(self, *args, **kwargs):
+        """Namespace.marshal_with, timing the marshalling as the marshal phase"""
+        marshal_with = self.default_namespace.marshal_with(*args, **kwargs)
+
+        def decorator(func):
+            @wraps(func)
+            def handler(*a, **kw):
+                try:
+                    return func(*a, **kw)
+                finally:
+                    flask.g.astro_handled = time.perf_counter()
+            marshalled = marshal_with(handler)
+
+            @wraps(marshalled)
+            def timed(*a, **kw):
+                result = marshalled(*a, **kw)
+                phases = flask.g.get('astro_phases')
+                if phases is not None:
+                    phases['marshal'] = (phases.get('marshal', 0.0)
+                                         + time.perf_counter() - flask.g.astro_handled)
+                return result
+            return timed
+        return decorator
+
+    def abort_counted(self, check, code, message):
+        """api.abort, counting the abort under the existence check that made it"""
+        rule = flask.request.url_rule
+        self.recorder.count(ABORTS, (('route', rule.rule if rule else ''),
+                                     ('check', check), ('code', str(code))))
+        self.abort(code, message)
+
+    def make_response(self, data, *args, **kwargs):
+        with phase('write'):
+            return super().make_response(data, *args, **kwargs)
+
+    def output(self, resource):
+        view = super().output(resource)
+
+        @wraps(view)
+        def timed(*args, **kwargs):
+            flask.g.astro_phases = {}
+            start = time.perf_counter()
+            code = 500
+            try:
+                response = view(*args, **kwargs)
+                if isinstance(response, Response):
+                    code = response.status_code
+                return response
+            except HTTPException as error:
+                code = error.code
+                raise
+            finally:
+                self._record(time.perf_counter() - start, flask.g.pop('astro_phases'), code)
+        return timed
+
+    def _record(self, total, phases, code):
+        labels = (('route', flask.request.url_rule.rule), ('method', flask.request.method))
+        handler = total - sum(phases.values())
+        for name, seconds in phases.items():
+            self.recorder.observe(REQUEST_SECONDS, labels + (('phase', name),), seconds)
+        self.recorder.observe(REQUEST_SECONDS, labels + (('phase', 'handler'),), max(handler, 0.0))
+        self.recorder.observe(REQUEST_SECONDS, labels + (('phase', 'total'),), total)
+        self.recorder.count(RESPONSES, labels + (('code', str(code)),))
@@ -0,0 +1,60 @@
+"""Per-planet inverted index of what can be collected there"""
+import threading
+
+from condenser import parse_rates
+
+# the found column uses this for resources that are on every planet
+EVERYWHERE = 'All'
+
+
+class PlanetIndex:
+    """Resources found on each planet and gases a condenser collects there
+
+    Built from the resources' found and rate lists when the index is created
+    and kept up to date through the collection listener, so "what is on
+    planet X" is a dict lookup rather than a scan of every resource.
+    """
+
+    def __init__(self, resources):
+        self.resources = resources
+        self._found = {}
+        self._gases = {}
+        self._everywhere = {}
+        self._lock = threading.Lock()
+        for resource in resources:
+            self._update(None, resource)
+        resources.subscribe(self._changed)
+
+    def _update(self, old, new):
+        if old is not None:
+            self._everywhere.pop(old['name'], None)
+            for planet in old['found']:
+                self._found.get(planet, {}).pop(old['name'], None)
+            for planet in parse_rates(old['rate']):
+                self._gases.get(planet, {}).pop(old['name'], None)
+        if new is not None:
+            for planet in new['found']:
+                if planet == EVERYWHERE:
+                    self._everywhere[new['name']] = None
+                else:
+                    self._found.setdefault(planet, {})[new['name']] = None
+            for planet, rate in parse_rates(new['rate']).items():
+                self._gases.setdefault(planet, {})[new['name']] = rate
+
+    def _changed(self, old, new):
+        with self._lock:
+            if old is None and new is None:
+                self._found, self._gases, self._everywhere = {}, {}, {}
+                for resource in self.resources:
+                    self._update(None, resource)
+            else:
+                self._update(old, new)
+
+    def available(self, planet):
+        """{'resources': [name, ...], 'gases': [(gas, rate), ...]} on planet"""
+        self.resources.sync()
+        with self._lock:
+            return {
+                'resources': list(self._everywhere) + list(self._found.get(planet, ())),
+                'gases': sorted(self._gases.get(planet, {}).items(), key=lambda x: -x[1]),
+            }
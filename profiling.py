@@ -0,0 +1,173 @@
+"""Sampled cProfile runs of live requests, served as collapsed stacks
+
+A request is profiled when profiling is switched on in the app config and
+either it carries an X-Profile header or it is picked at the sample rate.
+Profiles are merged per endpoint over a rolling window and turned into the
+collapsed stack format flamegraph.pl and speedscope read, one
+`frame;frame;frame microseconds` line per stack.
+"""
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+
+import flask
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+ENDPOINT_KEY = 'astro.profile.endpoint'
+# how deep a stack is followed, and how much time a stack needs to be listed
+MAX_DEPTH = 64
+MIN_MICROSECONDS = 1
+
+
+def frame_name(func):
+    """pstats (file, line, function) key to a `file.py:function` frame"""
+    filename, _, name = func
+    if filename == '~':
+        return name.replace(';', ',')
+    return f"{os.path.basename(filename)}:{name}".replace(';', ',')
+
+
+def collapse(stats, root):
+    """{collapsed stack: microseconds} for a pstats.Stats, every stack under root
+
+    cProfile keeps caller -> callee edges rather than whole stacks, so a
+    function's time is split between the stacks that reach it in proportion
+    to the time each caller spent in it.
+    """
+    children = {}
+    roots = []
+    for func, (_, _, _, cumulative, callers) in stats.stats.items():
+        known = [caller for caller in callers if caller in stats.stats]
+        if not known:
+            roots.append(func)
+        for caller in known:
+            children.setdefault(caller, []).append((func, callers[caller][3]))
+    lines = {}
+
+    def walk(func, path, allotted, depth):
+        _, _, own, cumulative, _ = stats.stats[func]
+        share = allotted / cumulative if cumulative else 0.0
+        path = path + (frame_name(func),)
+        micros = int(own * share * 1e6)
+        if micros >= MIN_MICROSECONDS:
+            key = ';'.join(path)
+            lines[key] = lines.get(key, 0) + micros
+        if depth >= MAX_DEPTH:
+            return
+        for child, spent in children.get(func, ()):
+            if frame_name(child) not in path:
+                walk(child, path, spent * share, depth + 1)
+
+    for func in roots:
+        walk(func, (root,), stats.stats[func][3], 0)
+    return lines
+
+
+class RequestProfiler:
+    """WSGI middleware profiling sampled requests of a Flask app
+
+    Config: PROFILING turns it on, PROFILE_SAMPLE_RATE (0 to 1) profiles that
+    share of requests on top of those sent with an X-Profile header, and
+    PROFILE_WINDOW is how many seconds of profiles are kept per endpoint.
+
+    One request is profiled at a time, since from Python 3.12 a process can
+    only run one profiler; a sampled request arriving meanwhile is served
+    unprofiled. Only the app call is profiled and the body is passed
+    through as it comes, so a streamed body is not counted.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+        app.before_request(self._label)
+        self._lock = threading.Lock()
+        # held by the request being profiled
+        self._profiling = threading.Lock()
+        self._window_start = time.monotonic()
+        self._current = {}
+        self._previous = {}
+
+    @staticmethod
+    def _label():
+        rule = flask.request.url_rule
+        flask.request.environ[ENDPOINT_KEY] = (
+            f"{flask.request.method} {rule.rule if rule else '<unmatched>'}")
+
+    def _sampled(self, environ):
+        config = self.app.config
+        if not config.get('PROFILING'):
+            return False
+        return bool(environ.get(PROFILE_HEADER)) or (
+            random.random() < config.get('PROFILE_SAMPLE_RATE', 0.0))
+
+    def __call__(self, environ, start_response):
+        profile = self._start() if self._sampled(environ) else None
+        if profile is None:
+            return self.wsgi_app(environ, start_response)
+        try:
+            body = self.wsgi_app(environ, start_response)
+        finally:
+            profile.disable()
+            self._profiling.release()
+        self._add(environ.get(ENDPOINT_KEY, '<unmatched>'), profile)
+        return body
+
+    def _start(self):
+        """A running cProfile.Profile, or None while another profiler runs"""
+        if not self._profiling.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # a profiler this class didn't start, such as a debugger's
+            self._profiling.release()
+            return None
+        return profile
+
+    def _rotate(self):
+        """Start a new window once the current one is PROFILE_WINDOW old; hold the lock"""
+        now = time.monotonic()
+        window = self.app.config.get('PROFILE_WINDOW', 300)
+        if now - self._window_start >= window:
+            # a window with nothing profiled in it leaves no previous window
+            stale = now - self._window_start >= 2 * window
+            self._previous, self._current = ({} if stale else self._current), {}
+            self._window_start = now
+
+    def _add(self, endpoint, profile):
+        stats = pstats.Stats(profile)
+        with self._lock:
+            self._rotate()
+            if endpoint in self._current:
+                self._current[endpoint].add(stats)
+            else:
+                self._current[endpoint] = stats
+
+    def collapsed(self, endpoint=None):
+        """Collapsed stacks of the last one to two windows, endpoints as root frames
+
+        endpoint keeps only endpoints containing that text.
+        """
+        merged = {}
+        with self._lock:
+            self._rotate()
+            for window in (self._previous, self._current):
+                for name, stats in window.items():
+                    if not endpoint or endpoint in name:
+                        merged.setdefault(name, pstats.Stats()).add(stats)
+        lines = []
+        for name in sorted(merged):
+            for stack, micros in sorted(collapse(merged[name], name).items()):
+                lines.append(f"{stack} {micros}")
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def clear(self):
+        """Drop every profile collected so far"""
+        with self._lock:
+            self._current, self._previous = {}, {}
+            self._window_start = time.monotonic()
@@ -0,0 +1,92 @@
+"""Compact catalog records
+
+A record is a __slots__ object read like a read-only dict, so marshal, the
+serializers and every index keep working on record['name']. List fields are
+tuples of interned strings. A planet, machine or ingredient name is then one
+string object however many records mention it, and the tuple holds
+references to it. Empty lists share the one empty tuple.
+
+Records are shared between snapshots and must not be changed once built;
+replace a record to change it.
+"""
+import sys
+from collections.abc import Mapping
+from itertools import zip_longest
+
+EMPTY = ()
+
+
+def compact(value):
+    """Intern a string and turn a list of strings into a tuple of interned ones"""
+    if value.__class__ is str:
+        return sys.intern(value)
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return EMPTY
+        return tuple(sys.intern(x) if x.__class__ is str else x for x in value)
+    return value
+
+
+class Record(Mapping):
+    """Base for the record types, each of which lists its fields in FIELDS"""
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, *values):
+        """Field values in FIELDS order; missing trailing ones are None"""
+        for field, value in zip_longest(self.FIELDS, values):
+            object.__setattr__(self, field, compact(value))
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} records are read-only")
+
+    def __reduce__(self):
+        # rebuilt through __init__ so names are interned again when unpickled
+        return type(self), tuple(getattr(self, field) for field in self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    @classmethod
+    def from_json(cls, data):
+        """Build a record from a dict such as json.loads returns"""
+        return cls(*(data.get(field) for field in cls.FIELDS))
+
+    def to_json(self):
+        """A plain dict with lists, for json.dumps"""
+        return {field: list(value) if isinstance(value, tuple) else value
+                for field, value in self.items()}
+
+
+class Resource(Record):
+    """A resource, see server.resource_model"""
+
+    __slots__ = FIELDS = ('name', 'found', 'crafted_in', 'refined_with', 'rate')
+
+
+class Module(Record):
+    """A module, see server.module_model"""
+
+    __slots__ = FIELDS = ('name', 'resource_cost', 'printer')
+
+
+class Planet(Record):
+    """A planet, see server.planet_model"""
+
+    __slots__ = FIELDS = ('name', 'core_power', 'tetrahedron_resource', 'tetrahedron_power',
+                          'core_unlock', 'resources')
@@ -0,0 +1,115 @@
+"""Refinery and printer production scheduling
+
+A target list of modules and resources is unrolled into one task per craft
+over the resolver's recipe graph: each task is a resource refined in one of
+its crafted_in machines or a module printed in its printer, and depends on the
+tasks crafting its ingredients. Raw materials are taken to be on hand.
+Tasks are list scheduled onto the player's machine instances, highest
+critical path first, each placed on whichever allowed instance finishes it
+earliest. A plan needing more than MAX_TASKS crafts is refused rather than
+unrolled.
+"""
+import heapq
+
+from crafting import count_names
+
+MAX_TASKS = 100000
+
+
+class ScheduleError(ValueError):
+    """The plan asks for something that can't be made with the machines given"""
+
+
+# pylint: disable=too-many-arguments
+def unroll(resolver, modules, resources, machines, durations, max_tasks=MAX_TASKS):
+    """One task dict per craft, consumers before their ingredients
+
+    Raises ScheduleError for a recipe loop or more than max_tasks crafts.
+    """
+    tasks = []
+    visiting = set()
+
+    def add(item, allowed, consumer):
+        owned = [machine for machine in allowed if machines.get(machine, 0) > 0]
+        if not owned:
+            raise ScheduleError(f"No {' or '.join(allowed) or 'machine'} to make {item}")
+        if len(tasks) >= max_tasks:
+            raise ScheduleError(f"The plan needs more than {max_tasks} crafts")
+        times = {machine: durations.get(machine, 1) for machine in owned}
+        # the fastest machine is the critical path estimate, whichever one it ends up on
+        fastest = min(times.values())
+        task = {'id': len(tasks), 'item': item, 'consumer': consumer,
+                'durations': times, 'after': [],
+                'priority': fastest + (tasks[consumer]['priority'] if consumer is not None else 0)}
+        tasks.append(task)
+        if consumer is not None:
+            tasks[consumer]['after'].append(task['id'])
+        return task['id']
+
+    def expand(name, quantity, consumer):
+        recipe = resolver.recipe(name)
+        if not recipe:
+            return
+        if name in visiting:
+            raise ScheduleError(f"{name} is crafted from itself")
+        resource = resolver.resources.get(name)
+        visiting.add(name)
+        for _ in range(quantity):
+            task = add(name, resource['crafted_in'], consumer)
+            for ingredient, count in recipe.items():
+                expand(ingredient, count, task)
+        visiting.discard(name)
+
+    for name, quantity in modules.items():
+        module = resolver.modules.get(name)
+        if module is None:
+            raise KeyError(name)
+        for _ in range(quantity):
+            task = add(name, [module['printer']], None)
+            for ingredient, count in count_names(module['resource_cost']).items():
+                expand(ingredient, count, task)
+    for name, quantity in resources.items():
+        if not resolver.resources.exists(name):
+            raise KeyError(name)
+        expand(name, quantity, None)
+    return tasks
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def schedule(resolver, modules, resources, machines, durations, max_tasks=MAX_TASKS):
+    """Schedule every craft needed for the targets on the machines owned
+
+    modules and resources map names to quantities, machines maps machine
+    names to how many the player owns and durations optionally maps machine
+    names to the time one craft takes (1 by default). Returns
+    (makespan, steps) with steps ordered by start time.
+    """
+    tasks = unroll(resolver, modules, resources, machines, durations, max_tasks)
+    # a machine can't be busy with more crafts than there are, so extra instances go unused
+    free = {machine: [(0, instance) for instance in range(min(count, len(tasks)))]
+            for machine, count in machines.items() if count > 0}
+    waiting = [len(task['after']) for task in tasks]
+    ready = [(-task['priority'], task['id']) for task in tasks if not task['after']]
+    heapq.heapify(ready)
+    steps = [None] * len(tasks)
+    while ready:
+        _, task_id = heapq.heappop(ready)
+        task = tasks[task_id]
+        earliest = max((steps[dep]['end'] for dep in task['after']), default=0)
+        options = []
+        for machine, duration in task['durations'].items():
+            start = max(free[machine][0][0], earliest)
+            options.append((start + duration, start, machine))
+        end, start, machine = min(options)
+        _, instance = heapq.heappop(free[machine])
+        heapq.heappush(free[machine], (end, instance))
+        steps[task_id] = {'id': task_id, 'item': task['item'], 'machine': machine,
+                          'instance': instance, 'start': start, 'end': end,
+                          'after': task['after']}
+        consumer = task['consumer']
+        if consumer is not None:
+            waiting[consumer] -= 1
+            if not waiting[consumer]:
+                heapq.heappush(ready, (-tasks[consumer]['priority'], consumer))
+    steps.sort(key=lambda step: (step['start'], step['id']))
+    return max((step['end'] for step in steps), default=0), steps
@@ -0,0 +1,314 @@
+"""Name search over resources, modules and planets
+
+Names are normalized (case, `_` and `-` folded to spaces) and kept in two
+sorted arrays, one of whole keys and one of every later word's suffix of a
+key, so "alloy" finds Aluminum_Alloy. A prefix is a bisect into each array.
+A trigram index catches typos the prefix search can't, leaving out trigrams
+too common to tell names apart.
+"""
+import re
+import threading
+from array import array
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from itertools import chain
+
+import numpy as np
+
+# scores for how a name matched; trigram matches score their similarity, below 1
+EXACT, PREFIX, WORD_PREFIX = 3.0, 2.0, 1.5
+# trigram matches below this similarity aren't suggested
+MIN_SIMILARITY = 0.3
+# a prefix matching more keys than this has its best TOP_K entries kept between searches
+SCAN_LIMIT = 64
+TOP_K = 32
+# trigrams in more names than this don't narrow a fuzzy search down and are skipped
+MAX_POSTING = 1000
+# writes go to sorted lists merged into the arrays once they are as long, or this long
+MERGE_MIN = 1024
+# a word suffix is stored as the key's id << OFFSET_BITS | the offset the word starts at
+OFFSET_BITS = 16
+AFTER_ALL = chr(0x10ffff)
+SEPARATORS = re.compile(r'[\s_-]+')
+
+
+def normalize(name):
+    """Aluminum_Alloy, aluminum-alloy and ' Aluminum  Alloy' all become 'aluminum alloy'"""
+    return SEPARATORS.sub(' ', name.lower()).strip()
+
+
+def trigrams(key):
+    """Trigrams of a normalized key, padded so short keys still get some"""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def word_offsets(key):
+    """Where each word of a key after the first starts"""
+    offsets = []
+    at = key.find(' ')
+    while at != -1 and at + 1 >> OFFSET_BITS == 0:
+        offsets.append(at + 1)
+        at = key.find(' ', at + 1)
+    return offsets
+
+
+class SearchIndex:
+    """Sorted key arrays plus a trigram index over the names of several collections
+
+    collections maps a kind (resource, module, planet) to its collection;
+    every collection is followed through its listener.
+
+    Every name has an id, an index into the per-name lists. A removed name
+    keeps its id, marked dead, until the next merge renumbers the live ones,
+    so the arrays and posting lists never have entries taken out in place.
+
+    Listeners only queue the names written. The queue is applied by the
+    next search, or by catch_up(), one name at a time when it is short and
+    by building everything again when it is long, so loading a catalog
+    through the listeners costs one build.
+    """
+
+    def __init__(self, collections):
+        self.collections = collections
+        self._kind_order = list(collections)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._load([(kind, record['name']) for kind, collection in collections.items()
+                    for record in collection])
+        for kind, collection in collections.items():
+            collection.subscribe(self._listener(kind))
+
+    def _load(self, entries, keys=None):
+        """Build every structure from [(kind, name), ...] at once, keys normalizing the names"""
+        self._kinds = [kind for kind, _ in entries]
+        self._names = [name for _, name in entries]
+        self._keys = keys if keys is not None else [normalize(name) for name in self._names]
+        self._ids = {kind: {} for kind in self.collections}
+        for i, (kind, name) in enumerate(entries):
+            self._ids[kind][name] = i
+        # by id, the position of the kind in collections, or -1 once removed
+        self._kind_codes = array('b', map(self._kind_order.index, self._kinds))
+        self._dead = 0
+        keys = self._keys
+        self._whole = array('q', sorted(range(len(keys)), key=keys.__getitem__))
+        codes = [i << OFFSET_BITS | offset for i, key in enumerate(keys)
+                 for offset in word_offsets(key)]
+        self._words = array('q', sorted(codes, key=self._word_key))
+        self._new_whole, self._new_words = [], []
+        self._grams = {}
+        self._gram_counts = array('H')
+        for i, key in enumerate(keys):
+            grams = trigrams(key)
+            for gram in grams:
+                posting = self._grams.get(gram)
+                if posting is None:
+                    posting = self._grams[gram] = array('q')
+                posting.append(i)
+            self._gram_counts.append(min(len(grams), 0xffff))
+        # (table, prefix): {kinds: best ranks}, see _best
+        self._top = {}
+        self._top_length = 0
+
+    def _whole_key(self, i):
+        return self._keys[i]
+
+    def _word_key(self, code):
+        return self._keys[code >> OFFSET_BITS][code & ((1 << OFFSET_BITS) - 1):]
+
+    def _rank(self, i):
+        """Order among names matching the same way: shortest first, then by kind and name"""
+        return (len(self._names[i]), self._kinds[i], self._names[i], i)
+
+    def _listener(self, kind):
+        def changed(old, new):
+            with self._lock:
+                self._pending.append((kind, old and old['name'], new and new['name']))
+                # a queue nobody searches is applied before it outgrows the index
+                if len(self._pending) > max(MERGE_MIN, 4 * len(self._names)):
+                    self._apply_pending()
+        return changed
+
+    def catch_up(self):
+        """Apply the queued writes now rather than in the next search"""
+        with self._lock:
+            self._apply_pending()
+
+    def _apply_pending(self):
+        pending, self._pending = self._pending, []
+        if len(pending) <= max(MERGE_MIN, len(self._whole)) // 4:
+            for kind, old, new in pending:
+                if old is None and new is None:
+                    self._reload(kind)
+                    continue
+                if old is not None:
+                    self._remove(kind, old)
+                if new is not None:
+                    self._insert(kind, new)
+                self._maybe_merge()
+            return
+        live = {(self._kinds[i], name): self._keys[i]
+                for i, name in enumerate(self._names) if name is not None}
+        for kind, old, new in pending:
+            if old is None and new is None:
+                # the collection as it is now; replaying the writes after it changes nothing
+                live = {entry: key for entry, key in live.items() if entry[0] != kind}
+                live.update(((kind, record['name']), None) for record in self.collections[kind])
+                continue
+            if old is not None:
+                live.pop((kind, old), None)
+            if new is not None:
+                live[kind, new] = None
+        self._load(list(live), [key if key is not None else normalize(name)
+                                for (_, name), key in live.items()])
+
+    def _reload(self, kind):
+        entries = [(k, n) for k, n in zip(self._kinds, self._names)
+                   if n is not None and k != kind]
+        self._load(entries + [(kind, record['name']) for record in self.collections[kind]])
+
+    def _tables(self, i):
+        """(table, suffix) of each place a name's key is filed under"""
+        key = self._keys[i]
+        yield 'whole', key
+        for offset in word_offsets(key):
+            yield 'words', key[offset:]
+
+    def _insert(self, kind, name):
+        if name in self._ids[kind]:
+            self._remove(kind, name)
+        i = len(self._names)
+        key = normalize(name)
+        self._kinds.append(kind)
+        self._names.append(name)
+        self._keys.append(key)
+        self._ids[kind][name] = i
+        self._kind_codes.append(self._kind_order.index(kind))
+        insort(self._new_whole, i, key=self._whole_key)
+        for offset in word_offsets(key):
+            insort(self._new_words, i << OFFSET_BITS | offset, key=self._word_key)
+        grams = trigrams(key)
+        for gram in grams:
+            posting = self._grams.get(gram)
+            if posting is None:
+                posting = self._grams[gram] = array('q')
+            posting.append(i)
+        self._gram_counts.append(min(len(grams), 0xffff))
+        rank = self._rank(i)
+        for table, suffix in self._tables(i):
+            for end in range(1, min(len(suffix), self._top_length) + 1):
+                for kinds, best in self._top.get((table, suffix[:end]), {}).items():
+                    if kind in kinds and rank not in best and (
+                            len(best) < TOP_K or rank < best[-1]):
+                        insort(best, rank)
+                        del best[TOP_K:]
+
+    def _remove(self, kind, name):
+        i = self._ids[kind].pop(name, None)
+        if i is None:
+            return
+        rank = self._rank(i)
+        for table, suffix in self._tables(i):
+            for end in range(1, min(len(suffix), self._top_length) + 1):
+                cached = self._top.get((table, suffix[:end]))
+                if cached:
+                    # the name after the last kept one isn't known, so the list is dropped
+                    for kinds in [kinds for kinds, best in cached.items() if rank in best]:
+                        del cached[kinds]
+        self._names[i] = None
+        self._kind_codes[i] = -1
+        self._dead += 1
+
+    def _maybe_merge(self):
+        if self._dead + len(self._new_whole) > max(MERGE_MIN, len(self._whole)):
+            live = [i for i, name in enumerate(self._names) if name is not None]
+            self._load([(self._kinds[i], self._names[i]) for i in live],
+                       [self._keys[i] for i in live])
+
+    def _range(self, table, prefix):
+        """Ids or codes filed under keys starting with prefix, in the array and the new writes"""
+        if table == 'whole':
+            arrays, key = (self._whole, self._new_whole), self._whole_key
+        else:
+            arrays, key = (self._words, self._new_words), self._word_key
+        return [values[bisect_left(values, prefix, key=key):
+                       bisect_left(values, prefix + AFTER_ALL, key=key)] for values in arrays]
+
+    def _best(self, table, prefix, limit, kinds):
+        """Ranks of the best limit live names of kinds filed in table under prefix
+
+        A prefix matching more than SCAN_LIMIT keys is scanned once and its
+        best TOP_K kept, which writes then keep current.
+        """
+        ranges = self._range(table, prefix)
+        if sum(len(values) for values in ranges) > SCAN_LIMIT and limit <= TOP_K:
+            cached = self._top.setdefault((table, prefix), {})
+            self._top_length = max(self._top_length, len(prefix))
+            best = cached.get(kinds)
+            if best is None:
+                best = cached[kinds] = self._scan(table, ranges, TOP_K, kinds)
+            return best[:limit]
+        return self._scan(table, ranges, limit, kinds)
+
+    def _scan(self, table, ranges, limit, kinds):
+        shift = OFFSET_BITS if table == 'words' else 0
+        ids = {value >> shift for value in chain(*ranges)}
+        return nsmallest(limit, (self._rank(i) for i in ids
+                                 if self._names[i] is not None and self._kinds[i] in kinds))
+
+    def _similar(self, key, kinds, limit):
+        """{id: dice similarity} of the limit or so names most like key, if MIN_SIMILARITY
+
+        Names are found through the selective trigrams only, but scored on
+        all of them. Posting lists only ever get higher ids appended, so they
+        are sorted, and a common trigram is looked up for every candidate at
+        once with searchsorted instead of being read through.
+        """
+        grams = trigrams(key)
+        selective, common = [], []
+        for gram in grams:
+            posting = self._grams.get(gram)
+            if posting is not None:
+                # views on the arrays, dropped before any write can grow them
+                (common if len(posting) > MAX_POSTING else selective).append(
+                    np.frombuffer(posting, np.int64))
+        if not selective:
+            return {}
+        ids, counts = np.unique(np.concatenate(selective), return_counts=True)
+        for posting in common:
+            at = np.minimum(np.searchsorted(posting, ids), len(posting) - 1)
+            counts += posting[at] == ids
+        scores = 2 * counts / (len(grams) + np.frombuffer(self._gram_counts, np.uint16)[ids])
+        wanted = [self._kind_order.index(kind) for kind in kinds]
+        close = (scores >= MIN_SIMILARITY) & np.isin(
+            np.frombuffer(self._kind_codes, np.int8)[ids], wanted)
+        if close.sum() > limit:
+            # names tying the limit-th best score stay for search() to order by name
+            close &= scores >= np.partition(scores[close], -limit)[-limit]
+        return dict(zip(ids[close].tolist(), scores[close].tolist()))
+
+    def search(self, query, limit=10, kinds=None):
+        """[(kind, name, score), ...] best first"""
+        for collection in self.collections.values():
+            collection.sync()
+        kinds = frozenset(kinds or self.collections)
+        key = normalize(query)
+        if not key:
+            return []
+        with self._lock:
+            self._apply_pending()
+            scores = {}
+            for values in self._range('whole', key):
+                for i in values[:bisect_left(values, key + '\0', key=self._whole_key)]:
+                    if self._names[i] is not None and self._kinds[i] in kinds:
+                        scores[i] = EXACT
+            for table, score in (('whole', PREFIX), ('words', WORD_PREFIX)):
+                for rank in self._best(table, key, limit, kinds):
+                    scores.setdefault(rank[-1], score)
+            if len(scores) < limit:
+                # names already found may be among the closest, so ask for that many more
+                for i, score in self._similar(key, kinds, limit + len(scores)).items():
+                    scores.setdefault(i, score)
+            hits = [(self._kinds[i], self._names[i], score) for i, score in scores.items()]
+        ranked = sorted(hits, key=lambda hit: (-hit[2], len(hit[1]), hit[0], hit[1]))
+        return [(kind, name, round(score, 3)) for kind, name, score in ranked[:limit]]
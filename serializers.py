@@ -0,0 +1,137 @@
+"""JSON serializers compiled from api.model definitions
+
+marshal() looks up every field of every record through the field objects
+and builds a dict for json.dumps to walk again. compile_model turns a model
+into one generated function that reads a record dict and writes its JSON
+text directly, the same text json.dumps(marshal(record, model)) makes.
+Strings go through json's C encoder when the interpreter has it. orjson and
+friends are left out on purpose: they can't reproduce json.dumps' ", "
+separators and ASCII escaping, and responses have to stay byte for byte the
+same.
+
+Field types the compiler doesn't know, and records that are neither plain
+dicts nor records.Record, go through marshal() so the output never differs.
+"""
+import json
+from json.encoder import encode_basestring_ascii as quote
+from operator import attrgetter
+
+from flask_restx import fields, marshal
+
+from records import Record
+
+# fields compiled to inline code, matched on exact type so subclasses with their own rules aren't
+SCALARS = {
+    fields.String: "'null' if {v} is None else quote({v} if {v}.__class__ is str else str({v}))",
+    fields.Integer: "'null' if {v} is None else int.__repr__(int({v}))",
+    fields.Float: "'null' if {v} is None else number(float({v}))",
+}
+
+
+def number(value):
+    """A float the way json.dumps writes it"""
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return float.__repr__(value)
+
+
+def text(value):
+    """A list item of a fields.List(fields.String) the way json.dumps(marshal(...)) writes it"""
+    return 'null' if value is None else quote(str(value))
+
+
+def _plain(field):
+    """True when a field has no attribute, default or mask changing how it reads a value"""
+    return (field.attribute is None and field.default is None
+            and getattr(field, 'mask', None) is None)
+
+
+def _instance(field):
+    return field() if isinstance(field, type) else field
+
+
+def _reader(keys):
+    """A function reading keys off a Record into a tuple, picking attrgetter when it can"""
+    readers = {}
+
+    def read(record):
+        cls = record.__class__
+        reader = readers.get(cls)
+        if reader is None:
+            if keys and all(key in cls.FIELDS for key in keys):
+                getter = attrgetter(*keys)
+                reader = getter if len(keys) > 1 else lambda r: (getter(r),)
+            else:
+                reader = lambda r: tuple(r.get(key) for key in keys)  # noqa: E731
+            reader = readers.setdefault(cls, reader)
+        return reader(record)
+    return read
+
+
+def compile_model(model):
+    """A function turning a record dict into the JSON text marshal() and json.dumps make
+
+    Nested models in lists are compiled too. A model with a mask, or any
+    record that isn't a dict or Record, falls back to marshal().
+    """
+    resolved = getattr(model, 'resolved', model)
+
+    def slow(record):
+        return json.dumps(marshal(record, model))
+
+    if getattr(model, '__mask__', None):
+        return slow
+    env = {'quote': quote, 'number': number, 'text': text, 'dumps': json.dumps,
+           'slow': slow, 'fields': {}, 'Record': Record}
+    keys = tuple(resolved)
+    env['read'] = _reader(keys)
+    values = ', '.join(f'v{i}' for i in range(len(keys)))
+    lines = ['def serialize(record):',
+             '    if record.__class__ is dict:',
+             f'        ({values},) = [record.get(key) for key in {keys!r}]' if keys else '        pass',
+             '    elif isinstance(record, Record):',
+             f'        ({values},) = read(record)' if keys else '        pass',
+             '    else:',
+             '        return slow(record)',
+             '    try:']
+    parts = []
+    for i, (key, field) in enumerate(resolved.items()):
+        field = _instance(field)
+        env['fields'][key] = field
+        value, out = f'v{i}', f's{i}'
+        container = None
+        if type(field) is fields.List:
+            container = _instance(field.container)
+        if type(field) in SCALARS and _plain(field) and not getattr(field, 'discriminator', None):
+            lines.append(f'        {out} = ' + SCALARS[type(field)].format(v=value))
+        elif container is not None and _plain(field) and _plain(container) and (
+                type(container) is fields.String and not container.discriminator
+                or type(container) is fields.Nested and not container.allow_null
+                and not container.skip_none and not container.as_list):
+            if type(container) is fields.String:
+                item = 'quote(x) if x.__class__ is str else text(x)'
+            else:
+                name = f'nested{i}'
+                env[name] = compile_model(container.nested)
+                item = f'{name}(x)'
+            lines += [f'        if {value} is None:',
+                      f"            {out} = 'null'",
+                      f'        elif {value}.__class__ is tuple or {value}.__class__ is list:',
+                      f"            {out} = '[' + ', '.join([{item} for x in {value}]) + ']'",
+                      '        else:',
+                      f'            {out} = dumps(fields[{key!r}].output({key!r}, record))']
+        else:
+            lines.append(f'        {out} = dumps(fields[{key!r}].output({key!r}, record))')
+        parts.append(repr(('{' if i == 0 else ', ') + quote(key) + ': '))
+        parts.append(out)
+    if not parts:
+        lines.append('        pass')
+    parts.append(repr('}' if parts else '{}'))
+    lines += ['    except Exception:',
+              '        # let marshal raise (or handle) whatever the fast path tripped on',
+              '        return slow(record)',
+              '    return ' + ' + '.join(parts)]
+    exec('\n'.join(lines), env)  # pylint: disable=exec-used
+    return env['serialize']
@@ -1,23 +1,126 @@
 """cool"""
-import csv
+import json
+import math
+import os
 import sys
+import threading
+import time
+import zlib
+from functools import wraps
 
 import flask
-from flask_restx import Api, Resource, fields
+from flask_restx import Resource, fields, inputs, marshal
+from flask_restx.representations import output_json
+from flask_restx.utils import unpack
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+import catalog
+import ingest
+from bom import BomMatrix
+from cache import ENCODERS, ResponseCache
+from changes import ChangeLog, ResyncRequired, SharedChangeLog
+from condenser import RateMatrix
+from crafting import CraftingResolver, UsedByIndex
+from metrics import CONTENT_TYPE, InstrumentedApi, Recorder, phase
+from planets import PlanetIndex
+from profiling import RequestProfiler
+from records import Module as ModuleRecord, Planet as PlanetRecord, Resource as ResourceRecord
+from schedule import MAX_TASKS, ScheduleError, schedule
+from search import SearchIndex
+from serializers import compile_model
+from store import AlreadyExists, open_collection
+
 app = flask.Flask(__name__)
 app.config['RESTX_MASK_SWAGGER'] = False
 app.wsgi_app = ProxyFix(app.wsgi_app)
-api = Api(app, version="1.0.0", title="Astroneer",
-          description="An Astroneer API by the chunkinator, dude", prefix='/astro/v1')
+app.config['CATALOG_SNAPSHOT'] = os.environ.get('ASTRO_SNAPSHOT', catalog.SNAPSHOT)
+# `memory`, or `sqlite:///path/catalog.db` to share the catalog between worker processes
+app.config['CATALOG_STORE'] = os.environ.get('ASTRO_STORE', 'memory')
+# seconds between checks of the data files for edits to load, 0 to read them at startup only
+app.config['CATALOG_WATCH'] = float(os.environ.get('ASTRO_WATCH', 0))
+# how many writes the /changes feed keeps for clients to catch up on
+app.config['CHANGE_LOG_SIZE'] = int(os.environ.get('ASTRO_CHANGE_LOG', 10000))
+# profile requests sent with an X-Profile header, plus this share of all requests
+app.config['PROFILING'] = os.environ.get('ASTRO_PROFILING', '') not in ('', '0')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('ASTRO_PROFILE_RATE', 0))
+app.config['PROFILE_WINDOW'] = int(os.environ.get('ASTRO_PROFILE_WINDOW', 300))
+METRICS = Recorder()
+PROFILER = RequestProfiler(app)
+
+
+def plain_json():
+    """True while output_json writes bare json.dumps, which compiled serializers reproduce"""
+    return not app.debug and not app.config.get('RESTX_JSON')
+
+
+class AstroApi(InstrumentedApi):
+    """InstrumentedApi whose marshal_with writes compiled JSON straight into the response
+
+    Requests with an X-Fields mask, and marshal_with options the compiled
+    serializers don't cover, take flask_restx's own path.
+    """
+
+    def marshal_with(self, fields, *args, **kwargs):  # pylint: disable=redefined-outer-name
+        marshal_with = super().marshal_with(fields, *args, **kwargs)
+        if args or set(kwargs) - {'code', 'description'}:
+            return marshal_with
+        serialize = compile_model(fields)
+
+        def decorator(func):
+            stock = marshal_with(func)
+
+            @wraps(stock)
+            def compiled(*a, **kw):
+                if not plain_json() or flask.request.headers.get(app.config['RESTX_MASK_HEADER']):
+                    return stock(*a, **kw)
+                data, code, headers = unpack(func(*a, **kw))
+                with phase('marshal'):
+                    body = serialize(data) + '\n'
+                with phase('write'):
+                    return app.response_class(body, status=code, headers=headers,
+                                              mimetype='application/json')
+            return compiled
+        return decorator
+
+
+api = AstroApi(app, METRICS, version="1.0.0", title="Astroneer",
+               description="An Astroneer API by the chunkinator, dude", prefix='/astro/v1')
 
 # it appears that the only reason to have a namespace is to further segregate the swagger ui
 ns = api.namespace("Default", description="Default operations")
 resource_ns = api.namespace("Resources", description="Astroneer resources operations")
 module_ns = api.namespace("Modules", description="Astroneer modules operations")
+planet_ns = api.namespace("Planets", description="Astroneer planets operations")
+bom_ns = api.namespace("Bom", path="/bom", description="Bill of materials for module lists")
+schedule_ns = api.namespace("Schedule", path="/schedule",
+                            description="Refinery and printer production scheduling")
+search_ns = api.namespace("Search", path="/search",
+                          description="Name search over resources, modules and planets")
+condenser_ns = api.namespace("Condenser", description="Atmospheric Condenser gas collection")
+changes_ns = api.namespace("Changes", path="/changes",
+                           description="Feed of catalog writes for clients keeping a copy")
 
-DATABASE = {'modules': [], 'resources': [], 'planets': []}
+DATABASE = {kind: open_collection(app.config['CATALOG_STORE'], kind, record.from_json)
+            for kind, record in (('modules', ModuleRecord), ('resources', ResourceRecord),
+                                 ('planets', PlanetRecord))}
+RESOLVER = CraftingResolver(DATABASE['resources'], DATABASE['modules'])
+USED_BY = UsedByIndex(DATABASE['resources'], DATABASE['modules'])
+BOM = BomMatrix(RESOLVER)
+SEARCH = SearchIndex({'resource': DATABASE['resources'], 'module': DATABASE['modules'],
+                      'planet': DATABASE['planets']})
+RATES = RateMatrix(DATABASE['resources'])
+PLANET_INDEX = PlanetIndex(DATABASE['resources'])
+RESPONSES = ResponseCache()
+RESPONSES.watch('resources', DATABASE['resources'])
+RESPONSES.watch('modules', DATABASE['modules'])
+RESPONSES.watch('planets', DATABASE['planets'])
+for _collection in DATABASE.values():
+    RESPONSES.watch('debug', _collection)
+# a shared store numbers the changes itself, so every worker serves the same feed
+CHANGES = (SharedChangeLog(DATABASE) if app.config['CATALOG_STORE'].startswith('sqlite:')
+           else ChangeLog(app.config['CHANGE_LOG_SIZE']))
+for _kind, _collection in DATABASE.items():
+    CHANGES.watch(_kind, _collection)
 
 module_model = api.model("Module", {
     "name": fields.String(required=True,
@@ -64,6 +167,17 @@ planet_model = api.model("Planet", {
     "name": fields.String(
         required=True,
         description="The name of the planet"),
+    "core_power": fields.Float(
+        description="Power drawn to activate the planet core"),
+    "tetrahedron_resource": fields.String(
+        description="Resource found in the planet's gateway tetrahedron"),
+    "tetrahedron_power": fields.Float(
+        description="Power to activate a gateway tetrahedron"),
+    "core_unlock": fields.String(
+        description="Resource needed to unlock the planet core"),
+    "resources": fields.List(
+        fields.String,
+        description="Primary and secondary resources of the planet"),
 })
 planet_list = api.model("PlanetList", {
     "planets": fields.List(
@@ -73,32 +187,190 @@ planet_list = api.model("PlanetList", {
 })
 
 
+def split_names(value):
+    """Comma separated string (or an already split list) to a list of stripped names"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [x.strip() for x in value]
+
+
+# rate should be `planet:rate`
+# pylint: disable=too-many-arguments
+def make_resource(name, found=None, crafted_in=None, refined_with=None, rate=None):
+    """Build a resource record"""
+    return ResourceRecord(name, split_names(found), split_names(crafted_in),
+                          split_names(refined_with), split_names(rate))
+
+
+def make_module(name, resource_cost, printer):
+    """Build a module record"""
+    return ModuleRecord(name, split_names(resource_cost), printer)
+
+
+# pylint: disable=too-many-arguments
+def make_planet(name, core_power=None, tetrahedron_resource=None, tetrahedron_power=None,
+                core_unlock=None, resources=None):
+    """Build a planet record"""
+    return PlanetRecord(name, float(core_power) if core_power else None,
+                        tetrahedron_resource or None,
+                        float(tetrahedron_power) if tetrahedron_power else None,
+                        core_unlock or None, [x for x in split_names(resources) if x])
+
+
 def abort_if_module(module, **kwargs):
     """ Aborting protocol
     :key not_exists when true abort if name does not exist
     """
-    test = [x['name'] for x in DATABASE['modules'] if x['name'] == module]
+    test = DATABASE['modules'].exists(module)
     if 'not_exists' in kwargs:
         if not test:
-            api.abort(404, f"Module {module} doesn't exist")
+            api.abort_counted('module', 404, f"Module {module} doesn't exist")
         else:
             return
     if test:  # if empty, 404
-        api.abort(400, f"Module {module} already exists")
+        api.abort_counted('module', 400, f"Module {module} already exists")
 
 
 def abort_if_resource(resource, **kwargs):
     """ Aborting protocol
     :key not_exists when true abort if name does not exist
     """
-    test = [x['name'] for x in DATABASE['resources'] if x['name'] == resource]
+    test = DATABASE['resources'].exists(resource)
     if 'not_exists' in kwargs:
         if not test:
-            api.abort(404, f"Resource {resource} doesn't exist")
+            api.abort_counted('resource', 404, f"Resource {resource} doesn't exist")
         else:
             return
     if test:  # if empty, 404
-        api.abort(400, f"Resource {resource} already exists")
+        api.abort_counted('resource', 400, f"Resource {resource} already exists")
+
+
+def abort_missing(label, name):
+    """404 for the label ("Resource", "Module") record called name"""
+    api.abort_counted(label.lower(), 404, f"{label} {name} doesn't exist")
+
+
+def fetch_or_abort(kind, label, name):
+    """The record called name, read once from one snapshot of DATABASE[kind], or 404
+
+    Checking exists() and then calling get() on the live collection can
+    see a delete land in between and hand back None.
+    """
+    record = DATABASE[kind].snapshot().get(name)
+    if record is None:
+        abort_missing(label, name)
+    return record
+
+
+# compiled serializers of the api models, by model name
+SERIALIZERS = {}
+# narrowed page models are built per field selection; past this many they are rebuilt
+PAGE_MODELS_LIMIT = 256
+PAGE_MODELS = {}
+
+
+def json_bytes(data, model, serialize=None):
+    """marshal(data, model) as the response body output_json would send
+
+    serialize is model's compiled serializer, looked up by name for api models.
+    """
+    if not plain_json():
+        return output_json(marshal(data, model), 200).get_data()
+    if serialize is None:
+        serialize = SERIALIZERS.get(model.name)
+        if serialize is None:
+            serialize = SERIALIZERS.setdefault(model.name, compile_model(model))
+    return (serialize(data) + '\n').encode('utf8')
+
+
+def cached_listing(kind, model, collection):
+    """The full listing of a collection snapshot as a CachedBody, serialized once per version"""
+    version = collection.version
+    entry = RESPONSES.get(kind, version)
+    if entry is None:
+        with phase('marshal'):
+            body = json_bytes({kind: collection.all()}, model)
+        entry = RESPONSES.put(kind, version, body)
+    return entry
+
+
+def negotiate(entry, accept):
+    """(body, etag, Content-Encoding or None) of a CachedBody for an Accept-Encoding"""
+    encoding = accept.best_match(ENCODERS)
+    if encoding is None:
+        return entry.body, entry.etag, None
+    return entry.encoded(encoding) + (encoding,)
+
+
+def cached_response(entry):
+    """A CachedBody in the encoding the client prefers, answering If-None-Match with 304"""
+    with phase('write'):
+        body, etag, encoding = negotiate(entry, flask.request.accept_encodings)
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.content_encoding = encoding
+        return response.make_conditional(flask.request)
+
+
+def page_model(kind, item_model, names):
+    """(model, serializer) of {kind: [records cut down to names], next}, built once per selection"""
+    key = (kind, names)
+    entry = PAGE_MODELS.get(key)
+    if entry is None:
+        if len(PAGE_MODELS) >= PAGE_MODELS_LIMIT:
+            PAGE_MODELS.clear()
+        narrowed = {x: item_model[x] for x in names} if names is not None else item_model
+        model = {kind: fields.List(fields.Nested(narrowed)), 'next': fields.Integer}
+        entry = PAGE_MODELS[key] = (model, compile_model(model))
+    return entry
+
+
+def narrowed_page(kind, item_model, collection, after, limit, wanted=None):
+    """A page of records with its `next` cursor, as a JSON response body
+
+    wanted is a comma separated list of the fields to keep. Raises ValueError
+    for fields the model doesn't have.
+    """
+    names = None
+    if wanted is not None:
+        names = tuple(x.strip() for x in wanted.split(',') if x.strip())
+        unknown = [x for x in names if x not in item_model]
+        if unknown or not names:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    records, cursor = collection.page(after, limit)
+    with phase('marshal'):
+        return json_bytes({kind: records, 'next': cursor}, *page_model(kind, item_model, names))
+
+
+def list_response(kind, model, item_model):
+    """Serve a collection listing
+
+    A plain listing is marshalled, and compressed for each encoding asked
+    for, once per collection version, and answers conditional GETs with 304.
+    With limit/after/fields only the requested page and fields are
+    marshalled.
+    """
+    args = list_parser.parse_args()
+    collection = DATABASE[kind].snapshot()
+    if args['limit'] is None and args['after'] is None and args['fields'] is None:
+        return cached_response(cached_listing(kind, model, collection))
+    try:
+        body = narrowed_page(kind, item_model, collection, args['after'], args['limit'],
+                             args['fields'])
+    except ValueError as error:
+        api.abort(400, str(error))
+    with phase('write'):
+        return app.response_class(body, mimetype='application/json')
+
+
+def abort_if_planet(planet):
+    """404 unless the planet exists"""
+    if not DATABASE['planets'].exists(planet):
+        api.abort_counted('planet', 404, f"Planet {planet} doesn't exist")
 
 
 @ns.route("/")
@@ -107,7 +379,65 @@ class Debug(Resource):
 
     def get(self):
         """Debug print"""
-        return DATABASE
+        snapshots = {kind: collection.snapshot() for kind, collection in DATABASE.items()}
+        version = tuple(snapshot.version for snapshot in snapshots.values())
+        entry = RESPONSES.get('debug', version)
+        if entry is None:
+            with phase('marshal'):
+                body = output_json({kind: [record.to_json() for record in snapshot.all()]
+                                    for kind, snapshot in snapshots.items()}, 200).get_data()
+            entry = RESPONSES.put('debug', version, body)
+        return cached_response(entry)
+
+
+EXPORT_MODELS = (('resources', 'resource', resource_model),
+                 ('modules', 'module', module_model),
+                 ('planets', 'planet', planet_model))
+EXPORT_BATCH = 256
+
+
+def export_lines():
+    """Yield the catalog as NDJSON, one batch of lines at a time
+
+    Collections are walked with page cursors so only one batch is ever held,
+    and writes landing mid-export neither break the walk nor repeat records.
+    """
+    for kind, kind_name, model in EXPORT_MODELS:
+        collection = DATABASE[kind]
+        records, cursor = collection.page(None, EXPORT_BATCH)
+        while records:
+            yield ''.join(json.dumps({'kind': kind_name, 'record': marshal(record, model)}) + '\n'
+                          for record in records).encode('utf8')
+            if cursor is None:
+                break
+            records, cursor = collection.page(cursor, EXPORT_BATCH)
+
+
+def gzip_stream(chunks):
+    """gzip a byte stream, flushing after every chunk so clients see data as it is made"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+@ns.route("/export")
+class Export(Resource):
+    """Streams the whole catalog as newline delimited JSON"""
+
+    @api.doc(description="One line per resource, module and planet as "
+                         "`{\"kind\": ..., \"record\": ...}`. "
+                         "Sent gzipped when the client accepts gzip.")
+    @api.produces(["application/x-ndjson"])
+    def get(self):
+        """Export the catalog"""
+        body = export_lines()
+        headers = {'Vary': 'Accept-Encoding'}
+        if 'gzip' in flask.request.accept_encodings:
+            body = gzip_stream(body)
+            headers['Content-Encoding'] = 'gzip'
+        with phase('write'):
+            return app.response_class(body, mimetype='application/x-ndjson', headers=headers)
 
 
 resource_parser = api.parser()
@@ -135,6 +465,99 @@ module_parser.add_argument("printer", type=str, required=True,
                            location="form")
 
 
+list_parser = api.parser()
+list_parser.add_argument("limit", type=inputs.positive,
+                         help="Maximum number of records to return", location="args")
+list_parser.add_argument("after", type=inputs.natural,
+                         help="Cursor returned as `next` by the previous page", location="args")
+list_parser.add_argument("fields", type=str,
+                         help="Comma separated fields to return, e.g. name,printer",
+                         location="args")
+
+
+def bulk_items():
+    """Decode a bulk upload into (index, item, error) triples
+
+    The body is either a JSON array or, with an application/x-ndjson content
+    type, one JSON object per line read straight off the request stream.
+    """
+    if flask.request.mimetype == 'application/x-ndjson':
+        index = 0
+        for line in flask.request.stream:
+            if not line.strip():
+                continue
+            try:
+                yield index, json.loads(line), None
+            except ValueError as error:
+                yield index, None, f"Invalid JSON: {error}"
+            index += 1
+        return
+    items = flask.request.get_json(silent=True)
+    if not isinstance(items, list):
+        api.abort(400, "Expected a JSON array of records or an application/x-ndjson body")
+    for index, item in enumerate(items):
+        yield index, item, None
+
+
+def bulk_error(item, allowed, required):
+    """Why a bulk item can't be imported, or None if it is a valid record"""
+    if not isinstance(item, dict):
+        return "Record must be a JSON object"
+    unknown = sorted(set(item) - set(allowed))
+    if unknown:
+        return f"Unknown fields: {', '.join(unknown)}"
+    missing = [x for x in required if not item.get(x)]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    for key, value in item.items():
+        if key in ('name', 'printer'):
+            if not isinstance(value, str):
+                return f"{key} must be a string"
+        elif value is not None and not isinstance(value, str) and not (
+                isinstance(value, list) and all(isinstance(x, str) for x in value)):
+            return f"{key} must be a comma separated string or a list of strings"
+    return None
+
+
+def bulk_import(kind, label, builder, allowed, required):
+    """Validate every uploaded record in one pass, then add them all or none
+
+    The existence check is repeated by add_many inside the write, so a record
+    added by another request in between still fails the whole import.
+    """
+    collection = DATABASE[kind]
+    records, errors, seen = [], [], {}
+    total = 0
+    for index, item, error in bulk_items():
+        total += 1
+        error = error or bulk_error(item, allowed, required)
+        if error is None:
+            if collection.exists(item['name']) or item['name'] in seen:
+                error = f"{label} {item['name']} already exists"
+            seen.setdefault(item['name'], index)
+        if error is not None:
+            errors.append({'index': index,
+                           'name': item.get('name') if isinstance(item, dict) else None,
+                           'error': error})
+            continue
+        records.append(builder(**item))
+    if not errors:
+        try:
+            collection.add_many(records, replace=False)
+        except AlreadyExists as error:
+            errors = [{'index': seen[name], 'name': name, 'error': f"{label} {name} already exists"}
+                      for name in error.names]
+    if errors:
+        api.abort(400, f"{len(errors)} of {total} records rejected, nothing was imported",
+                  errors=errors)
+    return {'created': len(records)}, 201
+
+
+bulk_result = api.model("BulkResult", {
+    "created": fields.Integer(description="Number of records imported"),
+})
+
+
 #
 # resources
 #
@@ -149,65 +572,92 @@ class ResourceApi(Resource):
     @api.marshal_with(resource_model)
     def get(self, name_id):
         """Fetch a given resource"""
-        abort_if_resource(name_id, not_exists=True)
-        return [x for x in DATABASE['resources'] if x['name'] == name_id][0]
+        return fetch_or_abort('resources', 'Resource', name_id)
 
     @api.doc(responses={204: "Resource deleted"})
     def delete(self, name_id):
         """Delete a given resource"""
 
-        abort_if_resource(name_id, not_exists=True)
-        DATABASE['resources'].remove([x for x in DATABASE['resources'] if x['name'] == name_id][0])
+        try:
+            DATABASE['resources'].delete(name_id)
+        except KeyError:
+            abort_missing('Resource', name_id)
         return "", 204
 
     @api.doc(parser=resource_parser)
     @api.marshal_with(resource_model)
     def put(self, name_id):
         """Update a given resource"""
-        abort_if_resource(name_id, not_exists=True)
+        fetch_or_abort('resources', 'Resource', name_id)
         args = resource_parser.parse_args()
-        resource = {
-            'name': args["name"],
-            'found': [x.strip() for x in args["found"].split(',')
-                      ] if 'found' in args else [],
-            'crafted_in': [x.strip() for x in args['crafted_in'].split(',')
-                           ] if 'crafted_in' in args and args['crafted_in'] is not None else [],
-            'refined_with': [x.strip() for x in args['refined_with'].split(',')
-                             ] if 'refined_with' in args and args[
-                'refined_with'] is not None else [],
-            'rate': [x.strip() for x in args['rate'].split(',')
-                     ] if 'rate' in args and args['rate'] is not None else [],
-        }
-        DATABASE['resources'].remove([x for x in DATABASE['resources'] if x['name'] == name_id][0])
-        DATABASE['resources'].append(resource)
+        if args["name"] != name_id:
+            abort_if_resource(args["name"], exists=True)
+        resource = make_resource(**args)
+        try:
+            DATABASE['resources'].replace(name_id, resource)
+        except KeyError:
+            # deleted since the check above
+            abort_missing('Resource', name_id)
         return resource
 
 
+@resource_ns.route("/<string:name_id>/tree")
+@api.doc(responses={404: "Resource not found"}, params={"name_id": "The resource name"})
+class ResourceTreeApi(Resource):
+    """Expands a resource down to the raw materials it is refined from"""
+
+    def get(self, name_id):
+        """Crafting tree and raw material totals for a resource"""
+        abort_if_resource(name_id, not_exists=True)
+        return RESOLVER.resource_tree(name_id)
+
+
+used_by_entry = api.model("UsedByEntry", {
+    "name": fields.String(description="Resource or module name"),
+    "quantity": fields.Integer(description="Units of the resource it takes"),
+})
+used_by = api.model("UsedBy", {
+    "name": fields.String(description="The resource looked up"),
+    "resources": fields.List(fields.Nested(used_by_entry),
+                             description="Resources refined with it"),
+    "modules": fields.List(fields.Nested(used_by_entry),
+                           description="Modules that cost it to print"),
+})
+
+
+@resource_ns.route("/<string:name_id>/used-by")
+@api.doc(responses={404: "Resource not found"}, params={"name_id": "The resource name"})
+class ResourceUsedByApi(Resource):
+    """Reverse lookup of what a resource goes into"""
+
+    @api.marshal_with(used_by)
+    def get(self, name_id):
+        """Resources and modules made with a resource"""
+        abort_if_resource(name_id, not_exists=True)
+        users = USED_BY.used_by(name_id)
+        return {'name': name_id,
+                'resources': [{'name': n, 'quantity': q} for n, q in users['resources']],
+                'modules': [{'name': n, 'quantity': q} for n, q in users['modules']]}
+
+
 @resource_ns.route("/")
 class ResourceListApi(Resource):
     """Shows a list of all resources, and lets you POST to add new resources"""
 
-    # rate should be `planet:rate`
     # pylint: disable=too-many-arguments
     def hydrate(self, name, found=None, crafted_in=None, refined_with=None, rate=None):
         """Resource database is hydrated from csv files"""
-        resource = {
-            'name': name,
-            'found': [x.strip() for x in found.split(',')
-                      ] if found else [],
-            'crafted_in': [x.strip() for x in crafted_in.split(',')
-                           ] if crafted_in else [],
-            'refined_with': [x.strip() for x in refined_with.split(',')
-                             ] if refined_with else [],
-            'rate': [x.strip() for x in rate.split(',')
-                     ] if rate else [],
-        }
-        DATABASE['resources'].append(resource)
-
-    @api.marshal_list_with(resource_list)
+        resource = make_resource(name, found, crafted_in, refined_with, rate)
+        DATABASE['resources'].add(resource)
+
+    @api.doc(parser=list_parser,
+             description="With limit, after or fields the resources list is narrowed "
+                         "and a `next` cursor is added")
+    @api.response(200, "Success", resource_list)
+    @api.response(304, "Not modified since the ETag in If-None-Match")
     def get(self):
         """List all resources"""
-        return {'resources': DATABASE['resources']}
+        return list_response('resources', resource_list, resource_model)
 
     @api.doc(parser=resource_parser, responses={400: "Resource already exists"})
     @api.marshal_with(resource_model, code=201)
@@ -215,22 +665,26 @@ class ResourceListApi(Resource):
         """Create a resource"""
         args = resource_parser.parse_args()
         abort_if_resource(args["name"], exists=True)
-        resource = {
-            'name': args["name"],
-            'found': [x.strip() for x in args["found"].split(',')
-                      ] if 'found' in args and args['found'] is not None else [],
-            'crafted_in': [x.strip() for x in args['crafted_in'].split(',')
-                           ] if 'crafted_in' in args and args['crafted_in'] is not None else [],
-            'refined_with': [x.strip() for x in args['refined_with'].split(',')
-                             ] if 'refined_with' in args and args[
-                'refined_with'] is not None else [],
-            'rate': [x.strip() for x in args['rate'].split(',')
-                     ] if 'rate' in args and args['rate'] is not None else [],
-        }
-        DATABASE['resources'].append(resource)
+        resource = make_resource(**args)
+        DATABASE['resources'].add(resource)
         return resource, 201
 
 
+@resource_ns.route("/bulk")
+class ResourceBulkApi(Resource):
+    """Imports many resources in one request"""
+
+    @api.doc(description="Body is a JSON array of resources, or application/x-ndjson with "
+                         "one resource per line. List fields may be lists or comma separated "
+                         "strings. Either every record is imported or none are.",
+             responses={400: "Some records were rejected; `errors` lists them by index"})
+    @api.response(201, "Resources imported", bulk_result)
+    def post(self):
+        """Bulk create resources"""
+        return bulk_import('resources', 'Resource', make_resource,
+                           ('name', 'found', 'crafted_in', 'refined_with', 'rate'), ('name',))
+
+
 #
 # modules
 #
@@ -245,15 +699,16 @@ class ModuleApi(Resource):
     @api.marshal_with(module_model)
     def get(self, name_id):
         """Fetch a given module"""
-        abort_if_module(name_id, not_exists=True)
-        return [x for x in DATABASE['modules'] if x['name'] == name_id][0]
+        return fetch_or_abort('modules', 'Module', name_id)
 
     @api.doc(responses={204: "Module deleted"})
     def delete(self, name_id):
         """Delete a given module"""
 
-        abort_if_module(name_id, not_exists=True)
-        DATABASE['modules'].remove([x for x in DATABASE['modules'] if x['name'] == name_id][0])
+        try:
+            DATABASE['modules'].delete(name_id)
+        except KeyError:
+            abort_missing('Module', name_id)
         return "", 204
 
     @api.doc(parser=module_parser)
@@ -261,36 +716,48 @@ class ModuleApi(Resource):
     def put(self, name_id):
         """Update a given module"""
 
-        abort_if_module(name_id, not_exists=True)
+        fetch_or_abort('modules', 'Module', name_id)
         args = module_parser.parse_args()
+        if args["name"] != name_id:
+            abort_if_module(args["name"], exists=True)
         # need a good attribute replacement pattern for puts to update only some attributes
-        module = {
-            "name": args["name"],
-            "resource_cost": [x.strip() for x in args["resource_cost"].split(',')],
-            "printer": args["printer"]
-        }
-        DATABASE['modules'].remove([x for x in DATABASE['modules'] if x['name'] == name_id][0])
-        DATABASE['modules'].append(module)
+        module = make_module(**args)
+        try:
+            DATABASE['modules'].replace(name_id, module)
+        except KeyError:
+            # deleted since the check above
+            abort_missing('Module', name_id)
         return module
 
 
+@module_ns.route("/<string:name_id>/tree")
+@api.doc(responses={404: "Module not found"}, params={"name_id": "Module name"})
+class ModuleTreeApi(Resource):
+    """Expands a module's print cost down to raw materials"""
+
+    def get(self, name_id):
+        """Crafting tree and raw material totals for a module"""
+        abort_if_module(name_id, not_exists=True)
+        return RESOLVER.module_tree(name_id)
+
+
 @module_ns.route("/")
 class ModuleListApi(Resource):
     """Shows a list of all modules, and lets you POST to add new modules"""
 
     def hydrate(self, name, resource_cost, printer):
         """Hydrate the database with modules"""
-        module = {
-            "name": name,
-            "resource_cost": resource_cost,
-            "printer": printer
-        }
-        DATABASE['modules'].append(module)
-
-    @api.marshal_list_with(module_list)
+        module = make_module(name, resource_cost, printer)
+        DATABASE['modules'].add(module)
+
+    @api.doc(parser=list_parser,
+             description="With limit, after or fields the modules list is narrowed "
+                         "and a `next` cursor is added")
+    @api.response(200, "Success", module_list)
+    @api.response(304, "Not modified since the ETag in If-None-Match")
     def get(self):
         """List all modules"""
-        return {'modules': DATABASE['modules']}
+        return list_response('modules', module_list, module_model)
 
     @api.doc(parser=module_parser, responses={400: "Module already exists"})
     @api.marshal_with(module_model, code=201)
@@ -298,35 +765,584 @@ class ModuleListApi(Resource):
         """Create a module"""
         args = module_parser.parse_args()
         abort_if_module(args["name"], exists=True)
-        module = {
-            "name": args["name"],
-            "resource_cost": [x.strip() for x in args["resource_cost"].split(',')],
-            "printer": args["printer"]
-        }
-        DATABASE['modules'].append(module)
+        module = make_module(**args)
+        DATABASE['modules'].add(module)
         return module, 201
 
 
+@module_ns.route("/bulk")
+class ModuleBulkApi(Resource):
+    """Imports many modules in one request"""
+
+    @api.doc(description="Body is a JSON array of modules, or application/x-ndjson with "
+                         "one module per line. Either every record is imported or none are.",
+             responses={400: "Some records were rejected; `errors` lists them by index"})
+    @api.response(201, "Modules imported", bulk_result)
+    def post(self):
+        """Bulk create modules"""
+        return bulk_import('modules', 'Module', make_module,
+                           ('name', 'resource_cost', 'printer'),
+                           ('name', 'resource_cost', 'printer'))
+
+
+#
+# planets
+#
+
+
+planet_gas = api.model("PlanetGas", {
+    "gas": fields.String(description="Gas"),
+    "rate": fields.Float(description="Condenser units per minute"),
+})
+planet_available = api.model("PlanetAvailable", {
+    "planet": fields.String(description="Planet"),
+    "resources": fields.List(fields.String, description="Resources found on the planet"),
+    "gases": fields.List(fields.Nested(planet_gas),
+                         description="Gases a condenser collects there, fastest first"),
+})
+
+
+@planet_ns.route("/<string:name_id>")
+@api.doc(responses={404: "Planet not found"}, params={"name_id": "The planet name"})
+class PlanetApi(Resource):
+    """Show a single planet"""
+
+    @api.marshal_with(planet_model)
+    def get(self, name_id):
+        """Fetch a given planet"""
+        abort_if_planet(name_id)
+        return DATABASE['planets'].get(name_id)
+
+
+@planet_ns.route("/<string:name_id>/available")
+@api.doc(responses={404: "Planet not found"}, params={"name_id": "The planet name"})
+class PlanetAvailableApi(Resource):
+    """Everything that can be collected on a planet"""
+
+    @api.marshal_with(planet_available)
+    def get(self, name_id):
+        """Resources found and gases condensed on a planet"""
+        abort_if_planet(name_id)
+        available = PLANET_INDEX.available(name_id)
+        return {'planet': name_id,
+                'resources': available['resources'],
+                'gases': [{'gas': g, 'rate': r} for g, r in available['gases']]}
+
+
+@planet_ns.route("/")
+class PlanetListApi(Resource):
+    """Shows a list of all planets"""
+
+    # pylint: disable=too-many-arguments
+    def hydrate(self, name, core_power, tetrahedron_resource, tetrahedron_power, core_unlock,
+                resources):
+        """Hydrate the database with planets"""
+        DATABASE['planets'].add(make_planet(name, core_power, tetrahedron_resource,
+                                            tetrahedron_power, core_unlock, resources))
+
+    @api.doc(parser=list_parser,
+             description="With limit, after or fields the planets list is narrowed "
+                         "and a `next` cursor is added")
+    @api.response(200, "Success", planet_list)
+    @api.response(304, "Not modified since the ETag in If-None-Match")
+    def get(self):
+        """List all planets"""
+        return list_response('planets', planet_list, planet_model)
+
+
+#
+# bill of materials
+#
+
+
+def shopping_list_error(shopping_list):
+    """Why a shopping list is malformed, or None"""
+    if not isinstance(shopping_list, dict):
+        return "A shopping list must be an object of module name to quantity"
+    for module, quantity in shopping_list.items():
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0:
+            return f"Quantity of {module} must be a non-negative integer"
+    return None
+
+
+@bom_ns.route("/")
+class BomApi(Resource):
+    """Raw material totals for lists of modules"""
+
+    @api.doc(description="Body is one shopping list, e.g. "
+                         "`{\"Solar Array\": 4, \"Chemistry Lab\": 2, \"Tether\": 10}`, "
+                         "answered with its raw resource totals, or an array of shopping "
+                         "lists answered with an array of totals.",
+             responses={400: "Malformed shopping list or unknown module"})
+    def post(self):
+        """Total raw resources for shopping lists"""
+        body = flask.request.get_json(silent=True)
+        shopping_lists = body if isinstance(body, list) else [body]
+        for index, shopping_list in enumerate(shopping_lists):
+            error = shopping_list_error(shopping_list)
+            if error:
+                api.abort(400, error, index=index)
+        try:
+            totals = BOM.totals(shopping_lists)
+        except KeyError as error:
+            api.abort(400, f"Module {error.args[0]} doesn't exist")
+        return totals if isinstance(body, list) else totals[0]
+
+
+#
+# production schedule
+#
+
+
+schedule_step = api.model("ScheduleStep", {
+    "id": fields.Integer(description="Step id"),
+    "item": fields.String(description="Resource or module made"),
+    "machine": fields.String(description="Machine type"),
+    "instance": fields.Integer(description="Which of the owned machines of that type"),
+    "start": fields.Float(description="Start time"),
+    "end": fields.Float(description="End time"),
+    "after": fields.List(fields.Integer, description="Steps that must finish first"),
+})
+production_schedule = api.model("ProductionSchedule", {
+    "makespan": fields.Float(description="Time until the last step ends"),
+    "steps": fields.List(fields.Nested(schedule_step), description="Steps by start time"),
+})
+
+
+def counts_error(counts, what):
+    """Why a {name: count} body field is malformed, or None"""
+    if not isinstance(counts, dict):
+        return f"{what} must be an object of name to count"
+    for name, value in counts.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (
+                not math.isfinite(value) or value < 0):
+            return f"{what} for {name} must be a non-negative number"
+    return None
+
+
+@schedule_ns.route("/")
+class ScheduleApi(Resource):
+    """Plans which machine makes what, and when"""
+
+    @api.doc(description="Body: `{\"modules\": {\"Solar Array\": 4}, "
+                         "\"resources\": {\"Steel\": 2}, "
+                         "\"machines\": {\"Smelting Furnace\": 2, \"Chemistry Lab\": 1, "
+                         "\"Large Printer\": 1}, \"durations\": {\"Chemistry Lab\": 2}}`. "
+                         "Quantities and machine counts are integers; durations default to 1 "
+                         "per craft. Raw materials are taken to be on hand. A plan may need "
+                         f"at most {MAX_TASKS} crafts.",
+             responses={400: "Malformed plan, unknown item, recipe loop, too many crafts, "
+                             "or a craft with no machine for it"})
+    @api.marshal_with(production_schedule)
+    def post(self):
+        """Schedule the crafts for a bill of materials"""
+        body = flask.request.get_json(silent=True)
+        if not isinstance(body, dict):
+            api.abort(400, "Expected a JSON object")
+        plan = {}
+        for key in ('modules', 'resources', 'machines', 'durations'):
+            plan[key] = body.get(key, {})
+            error = counts_error(plan[key], key)
+            if error is None and key != 'durations' and any(
+                    not isinstance(x, int) for x in plan[key].values()):
+                error = f"{key} counts must be integers"
+            if error:
+                api.abort(400, error)
+        try:
+            makespan, steps = schedule(RESOLVER, **plan)
+        except KeyError as error:
+            api.abort(400, f"{error.args[0]} doesn't exist")
+        except ScheduleError as error:
+            api.abort(400, str(error))
+        return {'makespan': makespan, 'steps': steps}
+
+
+#
+# search
+#
+
+
+search_parser = api.parser()
+search_parser.add_argument("q", type=str, required=True, help="Name or part of a name",
+                           location="args")
+search_parser.add_argument("limit", type=inputs.positive, default=10,
+                           help="Maximum number of suggestions", location="args")
+search_parser.add_argument("kind", type=str, action="append",
+                           choices=("resource", "module", "planet"),
+                           help="Only suggest names of this kind", location="args")
+
+search_hit = api.model("SearchHit", {
+    "kind": fields.String(description="resource, module or planet"),
+    "name": fields.String(description="Name as stored"),
+    "score": fields.Float(description="3 exact, 2 prefix, 1.5 word prefix, below 1 fuzzy"),
+})
+search_results = api.model("SearchResults", {
+    "query": fields.String(description="The query"),
+    "results": fields.List(fields.Nested(search_hit), description="Suggestions, best first"),
+})
+
+
+@search_ns.route("/")
+class SearchApi(Resource):
+    """Autocomplete and typo tolerant lookup of names"""
+
+    @api.doc(parser=search_parser)
+    @api.marshal_with(search_results)
+    def get(self):
+        """Suggest names matching a query"""
+        args = search_parser.parse_args()
+        hits = SEARCH.search(args['q'], args['limit'], args['kind'])
+        return {'query': args['q'],
+                'results': [{'kind': k, 'name': n, 'score': s} for k, n, s in hits]}
+
+
+#
+# condenser
+#
+
+
+def gas_amounts(value):
+    """`Hydrogen:100, Argon:50` to {"Hydrogen": 100.0, "Argon": 50.0}"""
+    amounts = {}
+    for entry in value.split(','):
+        gas, _, units = entry.partition(':')
+        try:
+            amounts[gas.strip()] = float(units)
+        except ValueError:
+            raise ValueError(f"expected gas:units, got {entry.strip()!r}") from None
+        if not math.isfinite(amounts[gas.strip()]) or amounts[gas.strip()] <= 0:
+            raise ValueError(f"units must be a positive number, got {entry.strip()!r}")
+    return amounts
+
+
+gas_parser = api.parser()
+gas_parser.add_argument("gases", type=gas_amounts, required=True,
+                        help="Gases and units to collect, e.g. Hydrogen:100,Argon:50",
+                        location="args")
+time_parser = gas_parser.copy()
+time_parser.add_argument("planet", type=str, help="Only report this planet", location="args")
+
+planet_rate = api.model("PlanetRate", {
+    "planet": fields.String(description="Planet"),
+    "rate": fields.Float(description="Units per minute"),
+})
+gas_ranking = api.model("GasRanking", {
+    "gas": fields.String(description="Gas"),
+    "planets": fields.List(fields.Nested(planet_rate), description="Planets, fastest first"),
+})
+planet_time = api.model("PlanetTime", {
+    "planet": fields.String(description="Planet"),
+    "minutes": fields.Float(description="Minutes for one condenser, null if a gas is missing"),
+})
+collection_times = api.model("CollectionTimes", {
+    "planets": fields.List(fields.Nested(planet_time), description="Planets, fastest first"),
+})
+
+
+@condenser_ns.route("/<string:gas>")
+@api.doc(responses={404: "Gas not found"}, params={"gas": "Gas name"})
+class GasRankingApi(Resource):
+    """Ranks planets by how fast a condenser collects a gas"""
+
+    @api.marshal_with(gas_ranking)
+    def get(self, gas):
+        """Planets a gas is collected on, fastest first"""
+        try:
+            ranking = RATES.rank(gas)
+        except KeyError:
+            api.abort(404, f"Gas {gas} doesn't exist")
+        return {'gas': gas, 'planets': [{'planet': p, 'rate': r} for p, r in ranking]}
+
+
+@condenser_ns.route("/time")
+class CollectionTimeApi(Resource):
+    """How long a condenser takes to collect a mix of gases"""
+
+    @api.doc(parser=time_parser, responses={404: "Gas or planet not found"})
+    @api.marshal_with(collection_times)
+    def get(self):
+        """Minutes to collect the gases on each planet"""
+        args = time_parser.parse_args()
+        try:
+            times = RATES.collection_times(args['gases'])
+        except KeyError as error:
+            api.abort(404, f"Gas {error.args[0]} doesn't exist")
+        if args['planet'] is not None:
+            times = [(p, t) for p, t in times if p == args['planet']]
+            if not times:
+                api.abort(404, f"Planet {args['planet']} has no condenser gases")
+        return {'planets': [{'planet': p, 'minutes': t} for p, t in times]}
+
+
+@condenser_ns.route("/best")
+class BestPlanetApi(Resource):
+    """Finds the one planet where a condenser collects a whole gas list fastest"""
+
+    @api.doc(parser=gas_parser, responses={404: "Gas not found, or no planet has every gas"})
+    @api.marshal_with(planet_time)
+    def get(self):
+        """Best single planet for a gas shopping list"""
+        args = gas_parser.parse_args()
+        try:
+            best = RATES.best_planet(args['gases'])
+        except KeyError as error:
+            api.abort(404, f"Gas {error.args[0]} doesn't exist")
+        if best is None:
+            api.abort(404, "No single planet has every gas")
+        return {'planet': best[0], 'minutes': best[1]}
+
+
+#
+# change feed
+#
+
+
+CHANGES_MAX_WAIT = 60
+# a waiting long poll rechecks a blocking store this often, for writes made by other processes
+CHANGES_POLL_INTERVAL = 1.0
+
+
+def wait_seconds(value, argument='argument'):
+    """reqparse type for a long poll wait: whole seconds from 0 to CHANGES_MAX_WAIT"""
+    try:
+        seconds = int(value)
+    except ValueError:
+        seconds = -1
+    if not 0 <= seconds <= CHANGES_MAX_WAIT:
+        raise ValueError(f"Invalid {argument}: {value}. "
+                         f"{argument} must be an integer from 0 to {CHANGES_MAX_WAIT}")
+    return seconds
+
+
+changes_parser = api.parser()
+changes_parser.add_argument("since", type=inputs.natural,
+                            help="Cursor returned as `next` by the previous call",
+                            location="args")
+changes_parser.add_argument("limit", type=inputs.positive,
+                            help="Maximum number of changes to return", location="args")
+changes_parser.add_argument("wait", type=wait_seconds,
+                            help="Seconds to hold the request open until there is a change",
+                            location="args")
+changes_parser.add_argument("epoch", type=str,
+                            help="Epoch returned with the cursor", location="args")
+
+change_model = api.model("Change", {
+    "seq": fields.Integer(description="Sequence number"),
+    "kind": fields.String(description="resources, modules or planets"),
+    "op": fields.String(description="put or delete"),
+    "name": fields.String(description="Name of the record"),
+    "record": fields.Raw(description="The record as its item endpoint returns it, "
+                                     "null for a delete"),
+})
+change_page = api.model("ChangePage", {
+    "epoch": fields.String(description="Names the change log; send it back with the cursor"),
+    "next": fields.Integer(description="Cursor to pass as since for the changes after these"),
+    "changes": fields.List(fields.Nested(change_model), description="Changes, oldest first"),
+})
+ITEM_MODELS = {'resources': resource_model, 'modules': module_model, 'planets': planet_model}
+
+
+def change_page_data(since, limit=None, epoch=None):
+    """The changes after since as a change_page; just the current cursor when since is None
+
+    Aborts with 410 when they can't be had from the log, and with 400 for a
+    cursor ahead of it.
+    """
+    if since is None:
+        return {'epoch': CHANGES.epoch, 'next': CHANGES.seq, 'changes': []}
+    try:
+        found, cursor = CHANGES.since(since, limit, epoch)
+    except ResyncRequired:
+        message, extra = resync_details(since)
+        api.abort(410, message, **extra)
+    except ValueError as error:
+        api.abort(400, str(error))
+    return {'epoch': CHANGES.epoch, 'next': cursor, 'changes': [
+        {'seq': change.seq, 'kind': change.kind, 'name': change.name,
+         'op': 'put' if change.record is not None else 'delete',
+         'record': marshal(change.record, ITEM_MODELS[change.kind])
+         if change.record is not None else None}
+        for change in found]}
+
+
+def resync_details(since):
+    """(message, extra fields) of the 410 answering a cursor the log can't catch up"""
+    return (f"Resync required: the changes after {since} are no longer in the log. "
+            "Download the lists again, then continue from next",
+            {'next': CHANGES.seq, 'epoch': CHANGES.epoch})
+
+
+@changes_ns.route("/")
+class ChangesApi(Resource):
+    """Writes to resources, modules and planets since a cursor"""
+
+    @api.doc(parser=changes_parser,
+             responses={400: "The cursor is ahead of the log",
+                        410: "The cursor is older than the log or from another epoch"})
+    @api.marshal_with(change_page)
+    def get(self):
+        """List the changes after since
+
+        Without since only the current cursor is returned: take it before
+        downloading the lists, then ask for the changes after it. With wait,
+        a request with nothing new is held until there is a change.
+        """
+        args = changes_parser.parse_args()
+        deadline = time.monotonic() + (args['wait'] or 0)
+        blocking = any(collection.blocking for collection in DATABASE.values())
+        while True:
+            for collection in DATABASE.values():
+                collection.sync()
+            page = change_page_data(args['since'], args['limit'], args['epoch'])
+            remaining = deadline - time.monotonic()
+            if page['changes'] or args['since'] is None or remaining <= 0:
+                return page
+            CHANGES.wait(args['since'], min(remaining, CHANGES_POLL_INTERVAL) if blocking
+                         else remaining)
+
+
+#
+# metrics and profiling
+#
+
+
+@app.route("/metrics")
+def metrics():
+    """Request latency histograms and abort counts in Prometheus text format"""
+    return app.response_class(METRICS.render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/admin/profile", methods=["GET", "DELETE"])
+def profile():
+    """Collapsed stacks of the sampled requests, or DELETE to start over
+
+    `?endpoint=Resources` keeps only endpoints containing that text. The
+    output feeds straight into flamegraph.pl or speedscope.
+    """
+    if not app.config['PROFILING']:
+        flask.abort(404)
+    if flask.request.method == 'DELETE':
+        PROFILER.clear()
+        return "", 204
+    return app.response_class(PROFILER.collapsed(flask.request.args.get('endpoint')),
+                              mimetype='text/plain')
+
+
+#
+# startup
+#
+
+
+BUILDERS = {'resources': make_resource, 'modules': make_module, 'planets': make_planet}
+LISTINGS = {'resources': resource_list, 'modules': module_list, 'planets': planet_list}
+# the ingest pipeline behind the loaded catalog, see load_catalog; refreshed under RELOAD_LOCK
+PIPELINE = None
+RELOAD_LOCK = threading.Lock()
+WATCHER = None
+
+
+def apply_changes(changes):
+    """Write the [(kind, old, new), ...] an ingest.Pipeline refresh returns, one write per kind
+
+    Records the store already holds as they are are left alone, so workers
+    sharing a store don't write each change once each. Returns the kinds
+    written to.
+    """
+    ops = {}
+    for kind, old, new in changes:
+        name = (new if new is not None else old)['name']
+        if DATABASE[kind].get(name) != new:
+            ops.setdefault(kind, []).append((name, new))
+    for kind, batch in ops.items():
+        DATABASE[kind].write_many(batch)
+    return list(ops)
+
+
+def load_catalog(snapshot=None, data_dir=catalog.DATA_DIR):
+    """Fill the database from the data files, parsing only those changed since snapshot"""
+    global PIPELINE  # pylint: disable=global-statement
+    for collection in DATABASE.values():
+        collection.clear()
+    with RELOAD_LOCK:
+        PIPELINE = open_pipeline(snapshot, data_dir)
+        PIPELINE.refresh()
+        for kind, records in PIPELINE.catalog().items():
+            DATABASE[kind].add_many(records)
+    # the search index builds once for the whole catalog here, not in the first search
+    SEARCH.catch_up()
+
+
+def open_pipeline(snapshot=None, data_dir=catalog.DATA_DIR):
+    """An ingest pipeline starting from snapshot when there is one"""
+    state = catalog.read_snapshot(snapshot) if snapshot and os.path.exists(snapshot) else None
+    return ingest.Pipeline(data_dir, BUILDERS, state)
+
+
+def refresh_catalog():
+    """Apply edits made to the data files since the last refresh, returning how many records changed
+
+    Parsing happens before anything is written, and each collection takes
+    its changes in one write, so readers see the old catalog or the new one
+    and never wait for it. The list responses of the collections changed
+    are serialized and compressed again, and the search index takes the
+    changes, straight away rather than in the next request.
+    """
+    with RELOAD_LOCK:
+        changes = PIPELINE.refresh()
+        kinds = apply_changes(changes)
+    SEARCH.catch_up()
+    with app.app_context():
+        for kind in kinds:
+            entry = cached_listing(kind, LISTINGS[kind], DATABASE[kind].snapshot())
+            for encoding in ENCODERS:
+                entry.encoded(encoding)
+    if changes:
+        app.logger.info("Reloaded %d catalog records", len(changes))
+    return len(changes)
+
+
+def watch_catalog(interval):
+    """Refresh the catalog from a background thread whenever the loaded data files change"""
+    global WATCHER  # pylint: disable=global-statement
+    if WATCHER is None:
+        WATCHER = ingest.Watcher(catalog.source_paths(PIPELINE.data_dir), interval,
+                                 refresh_catalog, reload_failed)
+        WATCHER.start()
+    return WATCHER
+
+
+def reload_failed(error):
+    """Log a reload that raised; the catalog stays as it was before it"""
+    app.logger.error("Catalog reload failed", exc_info=error)
+
+
+def create_app():
+    """App factory for WSGI hosts, e.g. `gunicorn 'server:create_app()'`
+
+    A shared store that already holds a catalog is left alone, so a worker
+    starting up never wipes writes made through the others; with
+    CATALOG_WATCH set it still takes edits made to the data files after it
+    started.
+    """
+    global PIPELINE  # pylint: disable=global-statement
+    if not any(len(collection) for collection in DATABASE.values()):
+        load_catalog(app.config['CATALOG_SNAPSHOT'])
+    elif PIPELINE is None:
+        with RELOAD_LOCK:
+            PIPELINE = open_pipeline(app.config['CATALOG_SNAPSHOT'])
+            PIPELINE.refresh()
+    if app.config['CATALOG_WATCH']:
+        watch_catalog(app.config['CATALOG_WATCH'])
+    return app
+
+
 if __name__ == "__main__":
+    if 'build-snapshot' in sys.argv:
+        load_catalog()
+        catalog.write_snapshot(app.config['CATALOG_SNAPSHOT'], PIPELINE.state())
+        print(f"wrote {app.config['CATALOG_SNAPSHOT']}")
+        sys.exit(0)
     DEBUG = False
     if 'debug' in sys.argv:
         DEBUG = True
-    ALL_RESOURCES = []
-    with open('data/resources.csv', newline='', encoding='utf8') as f:
-        READER = csv.reader(f)
-        RESOURCE_HYDRATOR = ResourceListApi()
-        for r in READER:
-            ALL_RESOURCES.insert(0, r[0])
-            RESOURCE_HYDRATOR.hydrate(r[0], r[1], r[2], r[3], r[4])
-
-    MODULES = ['data/printing0.csv', 'data/printing1.csv', 'data/printing2.csv',
-               'data/printing3.csv']
-    PRINTERS = ['Backpack Printer', 'Small Printer', 'Medium Printer', 'Large Printer']
-    for FILE, PRINTER in zip(MODULES, PRINTERS):
-        with open(FILE, newline='', encoding='utf8') as f:
-            READER = csv.reader(f)
-            MODULE_HYDRATOR = ModuleListApi()
-            for r in READER:
-                MODULE_HYDRATOR.hydrate(r[0], [lines.strip() for lines in r[1].split(' ')], PRINTER)
-
-    app.run(debug=DEBUG)
+    create_app().run(debug=DEBUG)
@@ -0,0 +1,649 @@
+"""Catalog storage backends
+
+Two interchangeable collection backends live here: Collection keeps records in
+process memory, SqliteCollection keeps them in a local SQLite database so every
+worker process serves the same catalog. open_collection picks one from a store
+url.
+"""
+import json
+import sqlite3
+import threading
+import uuid
+from bisect import bisect_right
+from itertools import count
+
+# how many writes the sqlite change log keeps for workers to catch up on
+CHANGE_LOG_LIMIT = 10000
+# an in-memory commit copies one of this many shards per record it writes
+SHARDS = 256
+# set on a thread while SqliteCollection.sync is calling its listeners
+_NOTIFYING = threading.local()
+
+
+class AlreadyExists(ValueError):
+    """Raised by add_many(records, replace=False) when some names are already stored
+
+    names lists them; nothing was written.
+    """
+
+    def __init__(self, names):
+        super().__init__(f"already stored: {', '.join(names)}")
+        self.names = names
+
+
+class BaseCollection:
+    """The interface every collection backend implements
+
+    Records are mappings (dicts, or records.Record) keyed by their name field.
+    Listeners registered with subscribe are called as listener(old, new) after
+    every write: old is None for an insert, new is None for a delete, and both
+    are None when the whole collection changed at once and anything derived
+    from it must be rebuilt.
+    version goes up by one on every write.
+
+    blocking is true for backends whose reads and writes wait on I/O, which
+    async callers should run off the event loop.
+    """
+
+    blocking = False
+
+    def __init__(self, key='name'):
+        self.key = key
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """Call listener(old, new) after every write"""
+        self._listeners.append(listener)
+
+    def _notify(self, old, new):
+        for listener in self._listeners:
+            listener(old, new)
+
+    def sync(self):
+        """Bring listeners up to date with writes made elsewhere; a no-op for local backends"""
+
+    def snapshot(self):
+        """A consistent read-only view for a request that reads more than once
+
+        Backends without snapshots hand back the live collection.
+        """
+        return self
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __contains__(self, name):
+        return self.exists(name)
+
+    def exists(self, name):
+        """True when a record called name is stored"""
+        raise NotImplementedError
+
+    def get(self, name, default=None):
+        """Fetch the record called name"""
+        raise NotImplementedError
+
+    def all(self):
+        """Every record, in insertion order"""
+        return self.page()[0]
+
+    def page(self, after=None, limit=None):
+        """Up to limit (a positive int, or None for no limit) records inserted after the cursor after
+
+        Returns (records, cursor) where cursor is passed back as after to get
+        the next page, or None when there is nothing left.
+        """
+        raise NotImplementedError
+
+    def add(self, record):
+        """Append a record; an existing record of the same name is overwritten in place"""
+        raise NotImplementedError
+
+    def add_many(self, records, replace=True):
+        """Add every record, as one write where the backend supports it
+
+        With replace false a record never overwrites one of the same name:
+        AlreadyExists is raised instead and nothing is added. Backends writing
+        in one commit check under the same lock or transaction as the write.
+        """
+        if not replace:
+            taken = [record[self.key] for record in records if self.exists(record[self.key])]
+            if taken:
+                raise AlreadyExists(taken)
+        for record in records:
+            self.add(record)
+
+    def write_many(self, ops):
+        """Apply [(name, record), ...] as one write where the backend supports it
+
+        Each record takes the place of the one called name, or is added when
+        there is none; a None record deletes, and deleting a missing name is
+        skipped. Readers of an in-memory collection see all of it or none.
+        """
+        for name, record in ops:
+            if record is None:
+                if self.exists(name):
+                    self.delete(name)
+            elif self.exists(name):
+                self.replace(name, record)
+            else:
+                self.add(record)
+
+    def replace(self, name, record):
+        """Swap the record called name for record
+
+        When the name is unchanged the record keeps its position, a renamed
+        record moves to the end like a fresh insert. Raises KeyError when
+        there is no record called name.
+        """
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Remove the record called name and return it, KeyError when there is none"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Drop every record"""
+        for record in self.all():
+            self.delete(record[self.key])
+
+
+class Snapshot:
+    """One immutable version of an in-memory collection
+
+    Records are spread over SHARDS dicts of name -> (seq, record), so a commit
+    only copies the shards it touches and shares the rest with the snapshot
+    before it. The insertion log is an append-only list of (seq, name) shared
+    between snapshots, each of which only looks at its first log_len entries.
+    """
+
+    __slots__ = ('key', 'version', 'shards', 'log', 'log_len', 'count')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, key, version, shards, log, log_len, count):
+        self.key = key
+        self.version = version
+        self.shards = shards
+        self.log = log
+        self.log_len = log_len
+        self.count = count
+
+    def _entry(self, name):
+        return self.shards[hash(name) % SHARDS].get(name)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        log = self.log
+        for i in range(self.log_len):
+            seq, name = log[i]
+            entry = self._entry(name)
+            if entry is not None and entry[0] == seq:
+                yield entry[1]
+
+    def __contains__(self, name):
+        return self._entry(name) is not None
+
+    def exists(self, name):
+        """True when a record called name is stored"""
+        return self._entry(name) is not None
+
+    def get(self, name, default=None):
+        """Fetch the record called name"""
+        entry = self._entry(name)
+        return entry[1] if entry is not None else default
+
+    def all(self):
+        """Every record, in insertion order"""
+        return list(self)
+
+    def page(self, after=None, limit=None):
+        """See BaseCollection.page"""
+        log = self.log
+        i = bisect_right(log, (after or 0, chr(0x10ffff)), 0, self.log_len)
+        records, cursor = [], None
+        while i < self.log_len:
+            seq, name = log[i]
+            i += 1
+            entry = self._entry(name)
+            if entry is None or entry[0] != seq:
+                continue
+            if len(records) == limit:
+                cursor = self._entry(records[-1][self.key])[0]
+                break
+            records.append(entry[1])
+        return records, cursor
+
+
+class _Commit:
+    """The next snapshot being built by the single writer"""
+
+    def __init__(self, base, counter):
+        self.base = base
+        self.counter = counter
+        self.shards = list(base.shards)
+        self.copied = set()
+        self.log = base.log
+        self.log_len = base.log_len
+        self.count = base.count
+        self.changes = []
+        if len(self.log) != self.log_len:
+            # entries left behind by a commit that failed half way
+            self.log = self.log[:self.log_len]
+
+    def _shard(self, name, write=False):
+        i = hash(name) % SHARDS
+        if write and i not in self.copied:
+            self.shards[i] = dict(self.shards[i])
+            self.copied.add(i)
+        return self.shards[i]
+
+    def _stamp(self, name):
+        seq = next(self.counter)
+        self.log.append((seq, name))
+        self.log_len += 1
+        return seq
+
+    def apply(self, name, new, must_exist):
+        """Replace the record called name with new (None deletes it) and return the old one
+
+        Raises KeyError when must_exist and there is no such record; a delete
+        of a missing record is otherwise a no-op.
+        """
+        entry = self._shard(name).get(name)
+        old = entry[1] if entry is not None else None
+        if entry is None and must_exist:
+            raise KeyError(name)
+        if entry is None and new is None:
+            return None
+        if new is None or new[self.base.key] != name:
+            del self._shard(name, write=True)[name]
+            self.count -= 1
+        if new is not None:
+            new_name = new[self.base.key]
+            shard = self._shard(new_name, write=True)
+            current = shard.get(new_name)
+            if current is None:
+                self.count += 1
+            seq = current[0] if current is not None else self._stamp(new_name)
+            shard[new_name] = (seq, new)
+        self.changes.append((old, new))
+        return old
+
+    def publish(self):
+        """Freeze into the next snapshot"""
+        log = self.log
+        if self.log_len > 2 * self.count + 64:
+            # the log keeps dead entries until they outnumber the live ones
+            shards = self.shards
+            log = [(seq, name) for seq, name in log[:self.log_len]
+                   if shards[hash(name) % SHARDS].get(name, (None,))[0] == seq]
+        return Snapshot(self.base.key, self.base.version + len(self.changes),
+                        tuple(self.shards), log, len(log) if log is not self.log else self.log_len,
+                        self.count)
+
+
+class Collection(BaseCollection):
+    """In-memory backend with O(1) get, exists, replace and delete
+
+    Reads go to an immutable Snapshot that is swapped in whole on every
+    commit, so readers never take a lock and never see a write half applied.
+    Writers queue on a single lock, build the next snapshot sharing all the
+    untouched shards, and publish it with one attribute assignment.
+
+    Every inserted name is stamped with an increasing sequence number, which
+    is what page cursors point at. Records inserted after a cursor was handed
+    out land behind it, so paging never skips or repeats a record. A renamed
+    record moves to the end like a fresh insert.
+    """
+
+    def __init__(self, key='name'):
+        super().__init__(key)
+        self._snapshot = Snapshot(key, 0, tuple({} for _ in range(SHARDS)), [], 0, 0)
+        self._write_lock = threading.Lock()
+        self._counter = count(1)
+
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        """The version of the current snapshot"""
+        return self._snapshot.version
+
+    def _write(self, ops, must_exist=False, must_be_new=False):
+        """Commit [(name, new), ...] as one snapshot and return the old records
+
+        Nothing is published if any op fails, or when must_be_new and some
+        names are already stored (AlreadyExists).
+        """
+        with self._write_lock:
+            if must_be_new:
+                taken = [name for name, _ in ops if self._snapshot.exists(name)]
+                if taken:
+                    raise AlreadyExists(taken)
+            commit = _Commit(self._snapshot, self._counter)
+            olds = [commit.apply(name, new, must_exist) for name, new in ops]
+            self._snapshot = commit.publish()
+            for old, new in commit.changes:
+                self._notify(old, new)
+        return olds
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def exists(self, name):
+        return self._snapshot.exists(name)
+
+    def get(self, name, default=None):
+        return self._snapshot.get(name, default)
+
+    def all(self):
+        return self._snapshot.all()
+
+    def page(self, after=None, limit=None):
+        return self._snapshot.page(after, limit)
+
+    def add(self, record):
+        self._write([(record[self.key], record)])
+        return record
+
+    def add_many(self, records, replace=True):
+        self._write([(record[self.key], record) for record in records], must_be_new=not replace)
+
+    def write_many(self, ops):
+        self._write(ops)
+
+    def replace(self, name, record):
+        self._write([(name, record)], must_exist=True)
+        return record
+
+    def delete(self, name):
+        old, = self._write([(name, None)], must_exist=True)
+        return old
+
+    def clear(self):
+        self._write([(record[self.key], None) for record in self._snapshot])
+
+
+class SqliteCollection(BaseCollection):
+    """SQLite backend shared by every worker process on the host
+
+    The database runs in WAL mode so readers never wait on the writer. Each
+    thread keeps its own connection, and statements are parameterized so
+    sqlite's statement cache reuses the prepared form.
+
+    Every write also lands in a change log table together with the new
+    version. Before a read, a worker replays the changes it hasn't seen yet to
+    its listeners, so caches and indexes built in one process follow writes
+    made by another. A worker that falls further behind than the log reaches
+    gets a single reset notification instead.
+
+    Changes are also numbered by seq, one sequence shared by every kind in
+    the database, which changes_after reads as the /changes feed so any
+    worker can answer a cursor another handed out. A rename takes two
+    numbers, its delete's and its put's. The feed table keeps the last
+    seq, the newest seq already dropped from the log (floor), and an epoch
+    naming the database.
+    """
+
+    blocking = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            body TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS records_kind_name ON records (kind, name);
+        CREATE INDEX IF NOT EXISTS records_kind_seq ON records (kind, seq);
+        CREATE TABLE IF NOT EXISTS versions (
+            kind TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            kind TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            old TEXT,
+            new TEXT,
+            seq INTEGER,
+            PRIMARY KEY (kind, version)
+        );
+        CREATE TABLE IF NOT EXISTS feed (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            epoch TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            floor INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path, kind, key='name', record=dict):
+        super().__init__(key)
+        self.path = path
+        self.kind = kind
+        self.record = record
+        self._local = threading.local()
+        self._sync_lock = threading.RLock()
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if 'seq' not in [row[1] for row in conn.execute("PRAGMA table_info(changes)")]:
+                # made before the feed was shared; the changes already logged have no seq
+                conn.execute("ALTER TABLE changes ADD COLUMN seq INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS changes_seq ON changes (seq)")
+            conn.execute("INSERT OR IGNORE INTO versions (kind, version) VALUES (?, 0)", (kind,))
+            conn.execute("INSERT OR IGNORE INTO feed (id, epoch, seq, floor) VALUES (0, ?, 0, 0)",
+                         (uuid.uuid4().hex[:12],))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._seen = self._stored_version()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self, body):
+        """A stored JSON body as a record, None for None"""
+        return self.record(json.loads(body)) if body else None
+
+    def _stored_version(self):
+        return self._connection().execute(
+            "SELECT version FROM versions WHERE kind = ?", (self.kind,)).fetchone()[0]
+
+    @property
+    def version(self):
+        """The collection version, after catching up on other workers' writes"""
+        self.sync()
+        return self._seen
+
+    def sync(self):
+        """Replay writes this process hasn't seen to the listeners
+
+        A listener reading any collection while it is being called doesn't
+        sync again: that would call listeners still holding their locks from
+        the outer call. Writes landing meanwhile are replayed by the next
+        sync.
+        """
+        if getattr(_NOTIFYING, 'active', False) or self._stored_version() == self._seen:
+            return
+        with self._sync_lock:
+            rows = self._connection().execute(
+                "SELECT version, old, new FROM changes WHERE kind = ? AND version > ? "
+                "ORDER BY version", (self.kind, self._seen)).fetchall()
+            if not rows:
+                return
+            _NOTIFYING.active = True
+            try:
+                if rows[0][0] != self._seen + 1:
+                    self._seen = rows[-1][0]
+                    self._notify(None, None)
+                    return
+                for version, old, new in rows:
+                    self._seen = version
+                    self._notify(self._load(old), self._load(new))
+            finally:
+                _NOTIFYING.active = False
+
+    def _write(self, ops, must_exist=False, must_be_new=False):
+        """Apply [(name, new), ...] in one transaction, each op logged as its own version
+
+        name is the stored record the op replaces (or the new record's own
+        name for an insert) and new is None for a delete. Returns the old
+        records. Raises KeyError, writing nothing, when must_exist and a
+        name isn't stored, and AlreadyExists when must_be_new and some are.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if must_be_new:
+                taken = [name for name, _ in ops
+                         if conn.execute("SELECT 1 FROM records WHERE kind = ? AND name = ?",
+                                         (self.kind, name)).fetchone()]
+                if taken:
+                    raise AlreadyExists(taken)
+            version = conn.execute("SELECT version FROM versions WHERE kind = ?",
+                                   (self.kind,)).fetchone()[0]
+            seq = conn.execute("SELECT seq FROM feed").fetchone()[0]
+            olds = []
+            for name, new in ops:
+                row = conn.execute("SELECT body FROM records WHERE kind = ? AND name = ?",
+                                   (self.kind, name)).fetchone()
+                old = row[0] if row else None
+                if old is None and must_exist:
+                    raise KeyError(name)
+                if old is None and new is None:
+                    # deleting a missing record changes nothing and logs nothing
+                    olds.append(None)
+                    continue
+                if old is not None and (new is None or new[self.key] != name):
+                    conn.execute("DELETE FROM records WHERE kind = ? AND name = ?",
+                                 (self.kind, name))
+                    seq += 1
+                body = None
+                if new is not None:
+                    body = json.dumps(dict(new))
+                    updated = conn.execute(
+                        "UPDATE records SET body = ? WHERE kind = ? AND name = ?",
+                        (body, self.kind, new[self.key])).rowcount
+                    if not updated:
+                        conn.execute("INSERT INTO records (kind, name, body) VALUES (?, ?, ?)",
+                                     (self.kind, new[self.key], body))
+                    seq += 1
+                version += 1
+                conn.execute("INSERT INTO changes (kind, version, old, new, seq) "
+                             "VALUES (?, ?, ?, ?, ?)", (self.kind, version, old, body, seq))
+                olds.append(self._load(old))
+            conn.execute("UPDATE versions SET version = ? WHERE kind = ?", (version, self.kind))
+            trimmed = conn.execute("SELECT MAX(seq) FROM changes WHERE kind = ? AND version <= ?",
+                                   (self.kind, version - CHANGE_LOG_LIMIT)).fetchone()[0]
+            conn.execute("UPDATE feed SET seq = ?, floor = MAX(floor, ?)", (seq, trimmed or 0))
+            conn.execute("DELETE FROM changes WHERE kind = ? AND version <= ?",
+                         (self.kind, version - CHANGE_LOG_LIMIT))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.sync()
+        return olds
+
+    def feed(self):
+        """(epoch, last seq) of the changes logged in the database, for every kind"""
+        return self._connection().execute("SELECT epoch, seq FROM feed").fetchone()
+
+    def changes_after(self, seq, limit=None):
+        """(epoch, last seq, floor, rows) of the database's change log, read at one moment
+
+        rows are (seq, kind, old body, new body) of the changes of every kind
+        numbered after seq, up to limit of them, oldest first. A rename's row
+        has the seq of its put, one after its delete's.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            head = conn.execute("SELECT epoch, seq, floor FROM feed").fetchone()
+            rows = conn.execute(
+                "SELECT seq, kind, old, new FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, -1 if limit is None else limit)).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return head + (rows,)
+
+    def __len__(self):
+        self.sync()
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM records WHERE kind = ?", (self.kind,)).fetchone()[0]
+
+    def exists(self, name):
+        self.sync()
+        return self._connection().execute(
+            "SELECT 1 FROM records WHERE kind = ? AND name = ?",
+            (self.kind, name)).fetchone() is not None
+
+    def get(self, name, default=None):
+        self.sync()
+        row = self._connection().execute(
+            "SELECT body FROM records WHERE kind = ? AND name = ?", (self.kind, name)).fetchone()
+        return self._load(row[0]) if row else default
+
+    def page(self, after=None, limit=None):
+        self.sync()
+        rows = self._connection().execute(
+            "SELECT seq, body FROM records WHERE kind = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (self.kind, after or 0, -1 if limit is None else limit + 1)).fetchall()
+        cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            cursor = rows[-1][0]
+        return [self._load(body) for _, body in rows], cursor
+
+    def add(self, record):
+        self._write([(record[self.key], record)])
+        return record
+
+    def add_many(self, records, replace=True):
+        self._write([(record[self.key], record) for record in records], must_be_new=not replace)
+
+    def write_many(self, ops):
+        self._write(ops)
+
+    def replace(self, name, record):
+        self._write([(name, record)], must_exist=True)
+        return record
+
+    def delete(self, name):
+        old, = self._write([(name, None)], must_exist=True)
+        return old
+
+    def clear(self):
+        self._write([(record[self.key], None) for record in self.all()])
+
+
+def open_collection(url, kind, record=dict):
+    """Open the collection for kind from a store url
+
+    `memory` keeps records in this process, `sqlite:///path/to/catalog.db`
+    shares them through a SQLite file. record builds a record from a dict
+    read back from a store that keeps them serialized.
+    """
+    if url == 'memory':
+        return Collection()
+    if url.startswith('sqlite:///'):
+        return SqliteCollection(url[len('sqlite:///'):], kind, record=record)
+    raise ValueError(f"Unknown store {url}, expected memory or sqlite:///path")